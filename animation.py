@@ -0,0 +1,102 @@
+'''
+
+Animation level of detail for PoultryGeist
+
+'''
+
+class AnimationLOD:
+	'''
+	Takes over the looping animations of a scene's Actors and poses them
+	at a rate which drops with their distance from the camera. Actors which
+	are off-screen aren't posed at all.
+	'''
+	# The maximum distance of each level and the number of frames between poses
+	levels = ((15, 1), (40, 2), (80, 4))
+	# The number of frames between poses beyond the last level
+	farInterval = 8
+
+	def __init__(self, cam):
+		# The camera nodepath, with the lens used for visibility checks
+		self.cam = cam
+		self.actors = []
+		# Map each actor to the animation being driven and its details
+		self.controls = {}
+		self.frame = 0
+		# The counters from the last update
+		self.jointsEvaluated = 0
+		self.actorsAnimated = 0
+		self.actorsStopped = 0
+
+	def register(self, actor):
+		'''
+		Add an Actor to be animated by the LOD system
+		'''
+		self.actors.append(actor)
+
+	def unregister(self, actor):
+		'''
+		Remove an Actor from the LOD system
+		'''
+		self.actors.remove(actor)
+		self.controls.pop(actor, None)
+
+	def takeOver(self, actor):
+		'''
+		Stop an Actor's playing animation and start driving it manually
+		'''
+		anim = actor.getCurrentAnim()
+		if anim is None:
+			return
+		control = actor.getAnimControl(anim)
+		# Store the control, frame rate, frame count and joint count
+		self.controls[actor] = (control, control.getFrameRate() * control.getPlayRate(), control.getNumFrames(), len(actor.getJoints()))
+		control.stop()
+
+	def getInterval(self, distance):
+		'''
+		Get the number of frames between poses for an Actor at a distance
+		'''
+		for maxDistance, interval in self.levels:
+			if distance <= maxDistance:
+				return interval
+		return self.farInterval
+
+	def isOnScreen(self, actor, lensBounds):
+		'''
+		Check if any part of the Actor is inside the camera's view
+		'''
+		bounds = actor.getBounds().makeCopy()
+		bounds.xform(actor.getMat(self.cam))
+		return lensBounds.contains(bounds) != 0
+
+	def update(self, time):
+		'''
+		Pose the Actors which are due an update this frame
+		'''
+		self.frame += 1
+		self.jointsEvaluated = 0
+		self.actorsAnimated = 0
+		self.actorsStopped = 0
+		lensBounds = self.cam.node().getLens().makeBounds()
+
+		for index, actor in enumerate(self.actors):
+			# Take over any animation the game has started playing on the Actor
+			if actor.getCurrentAnim() is not None:
+				self.takeOver(actor)
+			if actor not in self.controls:
+				continue
+
+			# Stop animating Actors that can't be seen
+			if not self.isOnScreen(actor, lensBounds):
+				self.actorsStopped += 1
+				continue
+
+			# Spread the Actors on the same level across different frames
+			interval = self.getInterval(actor.getDistance(self.cam))
+			if (self.frame + index) % interval:
+				continue
+
+			control, frameRate, numFrames, numJoints = self.controls[actor]
+			control.pose((time * frameRate) % numFrames)
+			self.actorsAnimated += 1
+			self.jointsEvaluated += numJoints
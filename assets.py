@@ -0,0 +1,267 @@
+'''
+
+Asset caching for PoultryGeist
+
+'''
+# Import the Panda3D Python modules
+from direct.actor.Actor import Actor
+
+# Import the C++ Panda3D modules
+from panda3d.core import Filename, Loader, LoaderOptions, NodePath, GeomPrimitive
+
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import threading
+
+class BamCache:
+	'''
+	Converts text .egg files into binary .bam files the first time they are
+	loaded and serves the cached .bam from then on. Entries are keyed on the
+	contents of the .egg file, so editing the source invalidates its entry.
+	'''
+	def __init__(self, cacheDir='cache/bam'):
+		self.cacheDir = cacheDir
+		# Store the digest of each source file, keyed on its path
+		# Each value is (modification time, size, digest)
+		self.digests = {}
+
+		# Create the cache directory if it doesn't exist yet
+		os.makedirs(self.cacheDir, exist_ok=True)
+
+	def resolve(self, modelName):
+		'''
+		Return the path of the model to load, converting .egg files to
+		cached .bam files where possible.
+		'''
+		eggName = self.findEgg(modelName)
+		# Leave anything that isn't an egg file untouched
+		if eggName is None:
+			return modelName
+
+		bamName = self.getCachePath(eggName)
+		# Convert the egg file if there isn't a cached copy of this version
+		if not os.path.exists(bamName):
+			if not self.convert(eggName, bamName):
+				return modelName
+			self.removeStale(eggName, bamName)
+		return bamName
+
+	def findEgg(self, modelName):
+		'''
+		Return the path of the .egg file for a model name, or None.
+		Animation names are often given without an extension, so check
+		for an egg file with the same name as well.
+		'''
+		if modelName.endswith('.egg') and os.path.exists(modelName):
+			return modelName
+		if os.path.splitext(modelName)[1] == '' and os.path.exists(modelName+'.egg'):
+			return modelName+'.egg'
+		return None
+
+	def getDigest(self, eggName):
+		'''
+		Hash the contents of the egg file, reusing the previous hash
+		if the file hasn't been touched since.
+		'''
+		stat = os.stat(eggName)
+		cached = self.digests.get(eggName)
+		if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+			return cached[2]
+
+		sha = hashlib.sha1()
+		with open(eggName, 'rb') as eggFile:
+			for block in iter(lambda: eggFile.read(1 << 20), b''):
+				sha.update(block)
+		digest = sha.hexdigest()
+		self.digests[eggName] = (stat.st_mtime, stat.st_size, digest)
+		return digest
+
+	def getCachePath(self, eggName):
+		'''
+		Get the path of the cached .bam file for the current egg contents
+		'''
+		return os.path.join(self.cacheDir, '{}-{}.bam'.format(self.getPrefix(eggName), self.getDigest(eggName)))
+
+	def getPrefix(self, eggName):
+		'''
+		Get a readable and unique file prefix for the egg file
+		'''
+		return os.path.splitext(eggName)[0].replace('/', '_').replace('\\', '_')
+
+	def convert(self, eggName, bamName):
+		'''
+		Load the egg file and write it out in binary form
+		'''
+		print("[>] PoultryGeist:\t      Converting {} to bam".format(eggName))
+		# Skip Panda3D's own model cache and load the egg text directly
+		options = LoaderOptions(LoaderOptions.LFSearch | LoaderOptions.LFNoCache | LoaderOptions.LFReportErrors)
+		node = Loader.getGlobalPtr().loadSync(Filename.fromOsSpecific(eggName), options)
+		if node is None:
+			return False
+		return writeBamFile(NodePath(node), bamName)
+
+	def removeStale(self, eggName, bamName):
+		'''
+		Delete the cached files for older versions of the egg file
+		'''
+		prefix = self.getPrefix(eggName)+'-'
+		for fileName in os.listdir(self.cacheDir):
+			path = os.path.join(self.cacheDir, fileName)
+			# Older versions share the prefix, followed by a 40 character digest
+			if fileName.startswith(prefix) and len(fileName) == len(prefix)+44 and path != bamName:
+				os.remove(path)
+
+class AssetCache:
+	'''
+	A process-wide cache of loaded models and Actors. Each request is given
+	a cheap copy which shares the geometry, textures and animations of the
+	cached original. The least recently used assets are evicted once the
+	estimated size of the cache goes over its memory budget.
+	'''
+	def __init__(self, loader, budget=256 * 2**20):
+		self.loader = loader
+		self.budget = budget
+		# Map each asset key to (original nodepath, estimated size in bytes)
+		# The least recently used asset is first
+		self.entries = OrderedDict()
+		self.usedBytes = 0
+		# Count the cache hits and misses
+		self.hits = 0
+		self.misses = 0
+		# Scenes can be loaded from the background thread, so guard the entries
+		self.lock = threading.Lock()
+
+	def getModel(self, modelName):
+		'''
+		Get a copy of a static model, loading it if it isn't cached
+		'''
+		original = self.lookup(modelName)
+		if original is None:
+			original = self.store(modelName, self.loader.loadModel(modelName))
+		return original.copyTo(NodePath())
+
+	def getActor(self, modelName, anims):
+		'''
+		Get a copy of an Actor and its animations, loading it if it isn't cached
+		'''
+		key = (modelName, tuple(sorted(anims.items())))
+		original = self.lookup(key)
+		if original is None:
+			original = self.store(key, Actor(modelName, anims))
+		# Copy the Actor, sharing its geometry and animation bundles
+		return Actor(other=original)
+
+	def lookup(self, key):
+		'''
+		Get a cached original and mark it as the most recently used
+		'''
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return entry[0]
+
+	def store(self, key, original):
+		'''
+		Add a newly loaded original to the cache and evict old entries
+		'''
+		size = estimateSize(original)
+		with self.lock:
+			# Another thread may have loaded the same asset in the meantime
+			if key in self.entries:
+				self.release(original)
+				self.entries.move_to_end(key)
+				return self.entries[key][0]
+			self.entries[key] = (original, size)
+			self.usedBytes += size
+			self.evict()
+		return original
+
+	def evict(self):
+		'''
+		Remove the least recently used assets until the cache fits the budget.
+		The newest asset is always kept, even if it is larger than the budget.
+		'''
+		while self.usedBytes > self.budget and len(self.entries) > 1:
+			key, (original, size) = self.entries.popitem(last=False)
+			self.usedBytes -= size
+			self.release(original)
+			# Let Panda3D's model pool free its copy of static models as well
+			if isinstance(key, str):
+				self.loader.unloadModel(key)
+
+	def release(self, original):
+		'''
+		Free a cached original. Copies that are still in use are unaffected.
+		'''
+		if isinstance(original, Actor):
+			original.cleanup()
+		else:
+			original.removeNode()
+
+	def clear(self):
+		'''
+		Empty the cache
+		'''
+		with self.lock:
+			for key, (original, size) in self.entries.items():
+				self.release(original)
+				if isinstance(key, str):
+					self.loader.unloadModel(key)
+			self.entries.clear()
+			self.usedBytes = 0
+
+def writeBamFile(nodePath, path):
+	'''
+	Write a node to a .bam file through a temporary file of its own, so a
+	crash or another thread writing the same file can't leave a broken copy
+	'''
+	handle, tempName = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path) or '.')
+	os.close(handle)
+	try:
+		if not nodePath.writeBamFile(Filename.fromOsSpecific(tempName)):
+			return False
+		os.replace(tempName, path)
+		return True
+	finally:
+		if os.path.exists(tempName):
+			os.remove(tempName)
+
+def estimateSize(nodePath):
+	'''
+	Estimate the memory used by the geometry and textures below a node
+	'''
+	size = 0
+	for geomNodePath in nodePath.findAllMatches('**/+GeomNode'):
+		geomNode = geomNodePath.node()
+		for i in range(geomNode.getNumGeoms()):
+			geom = geomNode.getGeom(i)
+			vertexData = geom.getVertexData()
+			for j in range(vertexData.getNumArrays()):
+				size += vertexData.getArray(j).getDataSizeBytes()
+			for j in range(geom.getNumPrimitives()):
+				size += geom.getPrimitive(j).getDataSizeBytes()
+	for texture in nodePath.findAllTextures():
+		size += texture.estimateTextureMemory()
+	return size
+
+def countTriangles(nodePath):
+	'''
+	Count the triangles in the geometry below a node
+	'''
+	count = 0
+	for geomNodePath in nodePath.findAllMatches('**/+GeomNode'):
+		geomNode = geomNodePath.node()
+		for i in range(geomNode.getNumGeoms()):
+			geom = geomNode.getGeom(i)
+			for j in range(geom.getNumPrimitives()):
+				primitive = geom.getPrimitive(j)
+				# Break strips and fans down into individual triangles before counting
+				if primitive.getPrimitiveType() == GeomPrimitive.PT_polygons:
+					count += primitive.decompose().getNumPrimitives()
+	return count
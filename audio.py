@@ -0,0 +1,166 @@
+'''
+
+Positional audio for PoultryGeist
+
+'''
+# Import the Panda3D Python modules
+from direct.showbase.Audio3DManager import Audio3DManager
+
+class SoundSource:
+	'''
+	A sound that an object wants to play. It only makes a noise while the
+	audio service has given it one of the voices.
+	'''
+	def __init__(self, nodePath, path, priority):
+		self.nodePath = nodePath
+		self.path = path
+		# Sources with a higher priority keep their voice from further away
+		self.priority = priority
+		self.playing = False
+		self.loop = False
+		# The frame time the sound started, used to keep silent sounds in time
+		self.startTime = 0
+		# The AudioSound playing the source, or None while it is virtual
+		self.voice = None
+
+class AudioService:
+	'''
+	Plays the positional sounds of a scene through one 3D audio manager.
+	Each sample is decoded once, and each update only the most important
+	sources, ranked by distance and priority, are given a voice from a fixed
+	pool. The rest are virtual: they are kept in time silently and get a
+	voice back when they rise up the ranking. One-shot sounds beyond the
+	audible distance are dropped instead.
+	'''
+	def __init__(self, app, listener, voiceCount=8, maxDistance=60):
+		self.app = app
+		self.listener = listener
+		self.voiceCount = voiceCount
+		self.maxDistance = maxDistance
+		# Create the single 3D manager, which tracks the listener's velocity once
+		self.audio3d = Audio3DManager(app.sfxManagerList[0], listener)
+		self.audio3d.setListenerVelocityAuto()
+
+		# Map each sample path to a loaded copy, keeping its decoded data cached
+		self.samples = {}
+		# Map each sample path to the voices which aren't playing
+		self.free = {}
+		self.sources = []
+
+		# The number of voices playing and of sources kept silent on the last update
+		self.activeVoices = 0
+		self.virtualVoices = 0
+		# The number of one-shot sounds dropped for being out of earshot
+		self.culled = 0
+
+	def loadSample(self, path):
+		'''
+		Load a sample once, returning the cached copy after that
+		'''
+		if path not in self.samples:
+			self.samples[path] = self.audio3d.loadSfx(path)
+			self.free[path] = []
+		return self.samples[path]
+
+	def addSource(self, nodePath, path, priority=1):
+		'''
+		Add a sound which follows a nodepath
+		'''
+		self.loadSample(path)
+		source = SoundSource(nodePath, path, priority)
+		self.sources.append(source)
+		return source
+
+	def removeSource(self, source):
+		'''
+		Remove a sound, freeing its voice
+		'''
+		self.stop(source)
+		self.sources.remove(source)
+
+	def play(self, source, loop=None):
+		'''
+		Start playing a source, if it isn't already, and set whether it loops
+		if loop is given
+		'''
+		if loop is not None:
+			source.loop = loop
+			if source.voice is not None:
+				source.voice.setLoop(loop)
+		if not source.playing:
+			source.playing = True
+			source.startTime = globalClock.getFrameTime()
+
+	def stop(self, source):
+		'''
+		Stop playing a source
+		'''
+		source.playing = False
+		self.releaseVoice(source)
+
+	def acquireVoice(self, source):
+		'''
+		Give a source a voice and start it at the point it should have reached
+		'''
+		free = self.free[source.path]
+		voice = free.pop() if free else self.audio3d.loadSfx(source.path)
+		voice.setLoop(source.loop)
+		elapsed = globalClock.getFrameTime() - source.startTime
+		length = voice.length()
+		voice.setTime(elapsed % length if source.loop and length > 0 else elapsed)
+		self.audio3d.attachSoundToObject(voice, source.nodePath)
+		self.audio3d.setSoundVelocityAuto(voice)
+		voice.play()
+		source.voice = voice
+
+	def releaseVoice(self, source):
+		'''
+		Take the voice from a source and return it to the pool
+		'''
+		voice = source.voice
+		if voice is None:
+			return
+		voice.stop()
+		self.audio3d.detachSound(voice)
+		self.free[source.path].append(voice)
+		source.voice = None
+
+	def update(self):
+		'''
+		Give the voices to the most important sources and silence the rest
+		'''
+		now = globalClock.getFrameTime()
+		ranked = []
+		for source in self.sources:
+			if not source.playing:
+				continue
+			# Finish one-shot sounds which have played to the end, heard or not
+			if not source.loop and now - source.startTime >= self.samples[source.path].length():
+				self.stop(source)
+				continue
+			distance = source.nodePath.getDistance(self.listener)
+			if not source.loop and distance > self.maxDistance:
+				self.stop(source)
+				self.culled += 1
+				continue
+			ranked.append((distance / source.priority, source))
+		ranked.sort(key=lambda entry: entry[0])
+
+		# Free the voices of the sources that have dropped out before handing any out
+		for score, source in ranked[self.voiceCount:]:
+			self.releaseVoice(source)
+		for score, source in ranked[:self.voiceCount]:
+			if source.voice is None:
+				self.acquireVoice(source)
+
+		self.activeVoices = min(len(ranked), self.voiceCount)
+		self.virtualVoices = len(ranked) - self.activeVoices
+
+	def destroy(self):
+		'''
+		Stop every sound and the 3D manager's update task
+		'''
+		for source in self.sources:
+			self.releaseVoice(source)
+		self.sources = []
+		self.audio3d.disable()
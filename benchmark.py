@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+'''
+
+Benchmarks for PoultryGeist
+
+Run with: python benchmark.py <benchmark> [options]
+
+'''
+# Import the C++ Panda3D modules
+from panda3d.core import NodePath, load_prc_file_data
+
+import argparse
+import json
+import os
+import sys
+import time
+from copy import deepcopy
+
+# A scripted walk through SceneOne, as camera positions
+WALK_PATH = ((0, 0, 3.5), (15.45, 0.5, 3.5), (15.45, -100, 3.5), (54.62, -227.6, 3.5), (86.83, -227.38, 3.5))
+# The frames taken to walk between each pair of positions
+WALK_FRAMES = 120
+
+def makeApp(quality='super-low', display='p3tinydisplay', fixedClock=False):
+	'''
+	Create the game Application in an offscreen window. By default this uses
+	Panda3D's software renderer so that no GPU is needed.
+	'''
+	load_prc_file_data("", """window-type offscreen
+							  load-display {}
+							  audio-library-name null
+							  sync-video #f
+							  gl-finish #t
+							  governor-target-fps 0
+							  profile-frames #t
+						   """.format(display))
+	# Step the clock by a fixed 60th of a second each frame, whatever the real time
+	if fixedClock:
+		load_prc_file_data("", """clock-mode non-real-time
+								  clock-frame-rate 60
+							   """)
+	from game import Application
+	return Application(quality)
+
+def timeIt(func, repeats):
+	'''
+	Run a function a number of times and return the mean time in milliseconds
+	'''
+	start = time.perf_counter()
+	for _ in range(repeats):
+		func()
+	return (time.perf_counter() - start) * 1000 / repeats
+
+def benchSceneSwitch(args):
+	'''
+	Measure the cost of a scene switch as the size of the scene graph grows
+	'''
+	app = makeApp()
+	from scene import Scene
+	# Only time the switch itself, not the upload of the new scene's resources
+	app.sceneMgr.warmUp = False
+
+	class SwitchScene(Scene):
+		'''
+		An empty scene filled with a chosen number of nodes
+		'''
+		def __init__(self, app, size):
+			Scene.__init__(self, app)
+			for i in range(size):
+				self.renderTree.attachNewNode('node-{}'.format(i))
+
+		def eventRun(self, task):
+			pass
+
+	def legacySwitch(template, nodes):
+		'''
+		The old scene switch, deep copying a template tree and reparenting
+		every child that isn't named 'camera'
+		'''
+		root = deepcopy(template)
+		for child in app.render.getChildren():
+			if not str(child).endswith('camera'):
+				child.detachNode()
+		for child in nodes:
+			child.reparentTo(root)
+		for child in root.getChildren():
+			if not str(child).endswith('camera'):
+				child.reparentTo(app.render)
+
+	template = deepcopy(app.render)
+	print("{:>8} {:>14} {:>14}".format("nodes", "legacy (ms)", "current (ms)"))
+	for size in args.sizes:
+		nodes = [NodePath('node-{}'.format(i)) for i in range(size)]
+		legacy = timeIt(lambda: legacySwitch(template, nodes), args.repeats)
+		for node in nodes:
+			node.removeNode()
+
+		# Switched out scenes are released, so build a fresh one for every switch
+		elapsed = 0
+		for _ in range(args.repeats):
+			scene = SwitchScene(app, size)
+			# Only time the switch, not the building of the scene
+			start = time.perf_counter()
+			app.sceneMgr.loadScene(scene)
+			elapsed += time.perf_counter() - start
+		current = elapsed * 1000 / args.repeats
+		print("{:>8} {:>14.3f} {:>14.3f}".format(size, legacy, current))
+
+def benchCrowd(args):
+	'''
+	Measure the cost of a crowd update as the number of chickens grows
+	'''
+	import random
+	from crowd import ChickenCrowd
+
+	class BenchChicken:
+		'''
+		A stand-in for a Chicken with a bare node and no-op reactions
+		'''
+		def __init__(self, root):
+			self.modelNodePath = root.attachNewNode('chicken')
+			self.modelNodePath.setPos(random.uniform(-20, 20), random.uniform(-20, 20), 0)
+
+		def notice(self):
+			pass
+
+		def escape(self):
+			pass
+
+		def chase(self, force):
+			pass
+
+	random.seed(0)
+	print("{:>8} {:>14} {:>16}".format("chickens", "update (ms)", "reactions/tick"))
+	for count in args.counts:
+		root = NodePath('render')
+		camera = root.attachNewNode('camera')
+		crowd = ChickenCrowd(camera)
+		chickens = [BenchChicken(root) for _ in range(count)]
+		for chicken in chickens:
+			crowd.add(chicken)
+
+		reactions = 0
+		elapsed = 0
+		for _ in range(args.ticks):
+			# Wander the chickens about so their bands keep changing
+			for chicken in chickens:
+				chicken.modelNodePath.setPos(chicken.modelNodePath, random.uniform(-1, 1), random.uniform(-1, 1), 0)
+			start = time.perf_counter()
+			crowd.update(1 / 60)
+			elapsed += time.perf_counter() - start
+			reactions += crowd.reactions
+		print("{:>8} {:>14.3f} {:>16.1f}".format(count, elapsed * 1000 / args.ticks, reactions / args.ticks))
+
+def benchLOD(args):
+	'''
+	Count the triangles in each quality tier of the models
+	'''
+	from panda3d.core import Filename, Loader
+	from assets import countTriangles
+	tiers = ('high', 'low', 'super-low')
+
+	print("{:<12}".format("model") + "".join("{:>12}".format(tier) for tier in tiers))
+	for modelName in args.models:
+		counts = []
+		for tier in tiers:
+			node = Loader.getGlobalPtr().loadSync(Filename('resources/{}/{}'.format(tier, modelName)))
+			counts.append("{:>12}".format(countTriangles(NodePath(node)) if node else '-'))
+		print("{:<12}".format(modelName) + "".join(counts))
+
+class FrameRecorder:
+	'''
+	Records the CPU and render time of every frame, using tasks which run
+	at the start of each frame and either side of the render task
+	'''
+	def __init__(self, app):
+		self.frames = []
+		self.frameStart = self.renderStart = None
+		# Frames run while this is off, such as loading screens, aren't recorded
+		self.recording = True
+		# ShowBase renders the frame in the igLoop task, at sort 50
+		app.taskMgr.add(self.startFrame, 'bench-frame-start', sort=-1000)
+		app.taskMgr.add(self.startRender, 'bench-render-start', sort=49)
+		app.taskMgr.add(self.endRender, 'bench-render-end', sort=51)
+
+	def startFrame(self, task):
+		self.frameStart = time.perf_counter()
+		return task.cont
+
+	def startRender(self, task):
+		self.renderStart = time.perf_counter()
+		return task.cont
+
+	def endRender(self, task):
+		end = time.perf_counter()
+		if not self.recording:
+			return task.cont
+		# Store the CPU, render and total time in milliseconds
+		self.frames.append(((self.renderStart - self.frameStart) * 1000, (end - self.renderStart) * 1000, (end - self.frameStart) * 1000))
+		return task.cont
+
+def benchCollision(args):
+	'''
+	Measure the cost of a collision traversal as the number of colliders
+	grows, against the map as one flat node and compiled into cells
+	'''
+	import random
+	from panda3d.core import CollisionHandlerPusher, CollisionNode, CollisionPolygon
+	from panda3d.core import CollisionSphere, CollisionTraverser, Point3, TransformState
+	from collision import MASK_MAP, MASK_ENTITY, CollisionWorld, compileCollider
+
+	# Build a flat map of floor tiles and walls, args.map_size units square
+	source = NodePath('map')
+	flat = CollisionNode('map-flat')
+	for x in range(0, args.map_size, 5):
+		for y in range(0, args.map_size, 5):
+			flat.addSolid(CollisionPolygon(Point3(x, y, 0), Point3(x+5, y, 0), Point3(x+5, y+5, 0), Point3(x, y+5, 0)))
+			if (x // 5 + y // 5) % 3 == 0:
+				flat.addSolid(CollisionPolygon(Point3(x, y, 0), Point3(x+5, y, 0), Point3(x+5, y, 4), Point3(x, y, 4)))
+	flat.setIntoCollideMask(MASK_MAP)
+	source.attachNewNode(flat)
+	compiled = compileCollider(source, TransformState.makeIdentity(), CollisionWorld.cellSize, CollisionWorld.regionSize)
+
+	random.seed(0)
+	print("{:>10} {:>12} {:>14}".format("colliders", "flat (ms)", "compiled (ms)"))
+	for count in args.counts:
+		results = []
+		for mapNode in (source, compiled):
+			root = NodePath('render')
+			mapNode.instanceTo(root)
+			traverser = CollisionTraverser()
+			pusher = CollisionHandlerPusher()
+			colliders = []
+			for _ in range(count):
+				collNode = CollisionNode('entity')
+				collNode.addSolid(CollisionSphere(0, 0, 1, 0.5))
+				collNode.setFromCollideMask(MASK_MAP)
+				collNode.setIntoCollideMask(MASK_ENTITY)
+				collider = root.attachNewNode(collNode)
+				collider.setPos(random.uniform(0, args.map_size), random.uniform(0, args.map_size), 0)
+				traverser.addCollider(collider, pusher)
+				pusher.addCollider(collider, collider)
+				colliders.append(collider)
+
+			def step():
+				# Move every collider a little, then traverse
+				for collider in colliders:
+					collider.setPos(collider, random.uniform(-0.5, 0.5), random.uniform(-0.5, 0.5), 0)
+				traverser.traverse(root)
+			results.append(timeIt(step, args.frames))
+		print("{:>10} {:>12.3f} {:>14.3f}".format(count, *results))
+
+def benchOcclusion(args):
+	'''
+	Report the draw calls of the SceneOne map at the fixed viewpoints in
+	its room file, with and without portal culling
+	'''
+	app = makeApp(args.quality)
+	from scene import SceneOne
+	scene = SceneOne(app)
+	if scene.occlusion is None:
+		sys.exit("SceneOne has no room file, so portal culling is off")
+	app.sceneMgr.loadScene(scene)
+
+	total = scene.occlusion.getTotalGeoms()
+	print("{:>30} {:>12} {:>10} {:>8}".format("viewpoint", "rooms", "culled", "all"))
+	for view in scene.occlusion.viewpoints:
+		app.camera.setPosHpr(*(view['pos'] + view['hpr']))
+		scene.occlusion.update()
+		print("{:>30} {:>12} {:>10} {:>8}".format(str(view['pos']), len(scene.occlusion.visible), scene.occlusion.drawCalls, total))
+
+def benchStreaming(args):
+	'''
+	Walk the camera across a large grid of generated cells and report the
+	resident cell count and memory, which should stay flat however far it walks
+	'''
+	app = makeApp()
+	from panda3d.core import CardMaker, Filename
+	from scene import Scene
+	from streaming import splitMap
+	import tempfile
+
+	# Build a map of small cards, 25 to a cell, and split it into cells
+	cellDir = tempfile.mkdtemp(prefix='poultrygeist-cells-')
+	cardMaker = CardMaker('tile')
+	cardMaker.setFrame(0, 1, 0, 1)
+	world = NodePath('world')
+	for x in range(0, args.cells * args.cell_size, args.cell_size // 5):
+		for y in range(0, args.cells * args.cell_size, args.cell_size // 5):
+			card = world.attachNewNode(cardMaker.generate())
+			card.setPosHpr(x, y, 0, 0, -90, 0)
+	for cell, cellNodePath in splitMap(world, args.cell_size).items():
+		cellNodePath.writeBamFile(Filename.fromOsSpecific(os.path.join(cellDir, 'world_{}_{}.bam'.format(*cell))))
+
+	scene = Scene(app)
+	app.sceneMgr.loadScene(scene)
+	streamer = scene.addStreamedWorld(cellDir, 'world', args.cell_size)
+
+	# Walk diagonally across the whole map, at a cell every few frames
+	length = args.cells * args.cell_size
+	peakBytes = peakCells = 0
+	print("{:>8} {:>10} {:>14}".format("frame", "resident", "memory (KiB)"))
+	for frame in range(args.frames):
+		offset = length * frame / args.frames
+		app.camera.setPos(offset, offset, 3.5)
+		app.taskMgr.step()
+		peakBytes = max(peakBytes, streamer.residentBytes)
+		peakCells = max(peakCells, len(streamer.resident))
+		if frame % (args.frames // 10) == 0:
+			print("{:>8} {:>10} {:>14.1f}".format(frame, len(streamer.resident), streamer.residentBytes / 1024))
+
+	loads = sum(1 for event in streamer.events if event[1] == 'load')
+	unloads = len(streamer.events) - loads
+	print("Peak of {} cells and {:.1f} KiB resident, {} loads and {} unloads".format(peakCells, peakBytes / 1024, loads, unloads))
+	# With hysteresis, no more than the unload square of cells can be resident
+	limit = (2 * streamer.unloadRadius + 1) ** 2
+	if peakCells > limit:
+		sys.exit("Resident cells grew beyond the limit of {}".format(limit))
+
+def getResidentMemory():
+	'''
+	Get the resident memory of the process in bytes, from /proc on Linux
+	'''
+	with open('/proc/self/statm') as statm:
+		return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def benchSoak(args):
+	'''
+	Switch between the menu and the intro many times, and fail if the node
+	count, task count or memory grows with the number of switches. The node
+	count includes the models held by the texture streamer.
+	'''
+	app = makeApp(args.quality, args.display)
+	from scene import MenuScene, IntroScene
+	scenes = (MenuScene, IntroScene)
+
+	def measure():
+		# Let any scene still building on the loading thread finish first
+		while app.taskMgr.hasTaskNamed('scene-preload'):
+			time.sleep(0.01)
+		app.taskMgr.step()
+		nodes = sum(root.findAllMatches('**').getNumPaths() for root in (app.render, app.render2d))
+		# Count the models the texture streamer holds, which live outside render once a scene is gone
+		if app.textureStreamer is not None:
+			nodes += sum(len(entry.users) for entry in app.textureStreamer.textures.values())
+		return nodes, len(app.taskMgr.getAllTasks()), getResidentMemory()
+
+	print("{:>8} {:>8} {:>8} {:>14}".format("cycle", "nodes", "tasks", "memory (MiB)"))
+	baseline = None
+	for cycle in range(args.warmup + args.cycles):
+		for sceneClass in scenes:
+			scene = sceneClass(app)
+			# Keep the intro from preloading SceneOne, which can't be built from this tree's resources
+			if isinstance(scene, IntroScene):
+				scene.nextScene = None
+			app.sceneMgr.loadScene(scene)
+			# Run enough frames for the scene's start events to run
+			for frame in range(args.frames):
+				app.taskMgr.step()
+		if cycle + 1 == args.warmup:
+			baseline = measure()
+		if (cycle + 1) % max(1, args.cycles // 10) == 0:
+			nodes, tasks, memory = measure()
+			print("{:>8} {:>8} {:>8} {:>14.1f}".format(cycle + 1, nodes, tasks, memory / 2**20))
+
+	nodes, tasks, memory = measure()
+	failures = []
+	if nodes != baseline[0]:
+		failures.append("node count went from {} to {}".format(baseline[0], nodes))
+	if tasks != baseline[1]:
+		failures.append("task count went from {} to {}".format(baseline[1], tasks))
+	if memory - baseline[2] > args.memory_tolerance * 2**20:
+		failures.append("memory grew by {:.1f} MiB".format((memory - baseline[2]) / 2**20))
+	if failures:
+		sys.exit("Scene switches leak: " + ", ".join(failures))
+	print("No growth over {} cycles".format(args.cycles))
+
+def percentile(values, fraction):
+	'''
+	Get a percentile of a list of values, using the nearest rank
+	'''
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarise(frames):
+	'''
+	Get the percentiles and worst value of each frame timing
+	'''
+	summary = {'frames': len(frames)}
+	for index, name in enumerate(('cpu', 'render', 'frame')):
+		values = [frame[index] for frame in frames]
+		summary[name] = {'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95), 'p99': percentile(values, 0.99), 'worst': max(values)}
+	return summary
+
+def findRegressions(summary, baseline, tolerance):
+	'''
+	List the timings which are worse than the baseline by more than the tolerance
+	'''
+	regressions = []
+	for name in ('cpu', 'render', 'frame'):
+		for stat in ('p50', 'p95', 'p99'):
+			limit = baseline[name][stat] * (1 + tolerance)
+			if summary[name][stat] > limit:
+				regressions.append('{} {}: {:.2f} ms > {:.2f} ms'.format(name, stat, summary[name][stat], limit))
+	return regressions
+
+def benchReplay(args):
+	'''
+	Replay the IntroScene motion path, and optionally walk through SceneOne,
+	with a fixed clock in an offscreen buffer
+	'''
+	if args.save_baseline and not args.baseline:
+		sys.exit("--save-baseline needs a --baseline file to write to")
+	app = makeApp(args.quality, args.display, fixedClock=True)
+	from scene import IntroScene, SceneOne
+	recorder = FrameRecorder(app)
+	intro = IntroScene(app)
+	# Stay in the intro when its path ends, SceneOne is only loaded for the walk
+	intro.nextScene = None
+	app.sceneMgr.loadScene(intro)
+
+	# Play the intro until its motion path ends
+	while len(recorder.frames) < args.max_frames:
+		app.taskMgr.step()
+		controller = app.controller
+		if controller is not None and controller.clock_obj.get_frame_time() > controller.curve_time_end:
+			break
+
+	if args.walk:
+		# Load SceneOne without recording, so the loader's timing can't change the recorded frames
+		recorder.recording = False
+		app.sceneMgr.preloadScene(SceneOne)
+		try:
+			while not app.sceneMgr.switchToPreloaded(SceneOne):
+				app.taskMgr.step()
+		except RuntimeError as error:
+			sys.exit("SceneOne could not be loaded for the walk: {}".format(error.__cause__ or error))
+		recorder.recording = True
+		# Move the camera along the walk path instead of reading the mouse
+		for start, end in zip(WALK_PATH, WALK_PATH[1:]):
+			for frame in range(WALK_FRAMES):
+				fraction = frame / WALK_FRAMES
+				app.camera.setPos(*(start[i] + (end[i] - start[i]) * fraction for i in range(3)))
+				app.taskMgr.step()
+
+	summary = summarise(recorder.frames)
+	# Add the time of each stage of the scene tasks
+	summary['stages'] = app.profiler.getSummary()
+	print(json.dumps(summary, indent=2))
+	if args.output:
+		with open(args.output, 'w') as outFile:
+			json.dump(summary, outFile, indent=2)
+
+	if args.save_baseline:
+		with open(args.baseline, 'w') as baselineFile:
+			json.dump(summary, baselineFile, indent=2)
+	elif args.baseline:
+		with open(args.baseline) as baselineFile:
+			regressions = findRegressions(summary, json.load(baselineFile), args.tolerance)
+		# Fail the run if any timing has regressed
+		if regressions:
+			print("[>] PoultryGeist:\t      Performance regressed:\n" + "\n".join(regressions))
+			sys.exit(1)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Run the PoultryGeist benchmarks')
+	subparsers = parser.add_subparsers(dest='benchmark')
+	subparsers.required = True
+
+	switchParser = subparsers.add_parser('scene-switch', help='cost of a scene switch against scene graph size')
+	switchParser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+	switchParser.add_argument('--repeats', type=int, default=20)
+	switchParser.set_defaults(func=benchSceneSwitch)
+
+	crowdParser = subparsers.add_parser('crowd', help='cost of a crowd AI update against chicken count')
+	crowdParser.add_argument('--counts', type=int, nargs='+', default=[2, 10, 100, 1000])
+	crowdParser.add_argument('--ticks', type=int, default=200)
+	crowdParser.set_defaults(func=benchCrowd)
+
+	lodParser = subparsers.add_parser('lod', help='triangle count of each quality tier of a model')
+	lodParser.add_argument('models', nargs='*', default=['barn.bam', 'ground.bam', 'laser.bam'])
+	lodParser.set_defaults(func=benchLOD)
+
+	collisionParser = subparsers.add_parser('collision', help='cost of a collision traversal against collider count')
+	collisionParser.add_argument('--counts', type=int, nargs='+', default=[1, 10, 100, 500])
+	collisionParser.add_argument('--map-size', type=int, default=300)
+	collisionParser.add_argument('--frames', type=int, default=60)
+	collisionParser.set_defaults(func=benchCollision)
+
+	occlusionParser = subparsers.add_parser('occlusion', help='draw calls of SceneOne at fixed viewpoints')
+	occlusionParser.add_argument('--quality', default='super-low')
+	occlusionParser.set_defaults(func=benchOcclusion)
+
+	streamingParser = subparsers.add_parser('streaming', help='resident memory while walking across a streamed map')
+	streamingParser.add_argument('--cells', type=int, default=20, help='cells along each side of the map')
+	streamingParser.add_argument('--cell-size', type=int, default=50)
+	streamingParser.add_argument('--frames', type=int, default=2000)
+	streamingParser.set_defaults(func=benchStreaming)
+
+	soakParser = subparsers.add_parser('soak', help='switch scenes repeatedly and fail if resources leak')
+	soakParser.add_argument('--cycles', type=int, default=200)
+	soakParser.add_argument('--warmup', type=int, default=5, help='cycles run before the baseline is measured')
+	soakParser.add_argument('--frames', type=int, default=3, help='frames run in each scene')
+	soakParser.add_argument('--memory-tolerance', type=float, default=16, help='allowed memory growth in MiB')
+	soakParser.add_argument('--quality', default='low', help='the only quality with every intro model')
+	soakParser.add_argument('--display', default='pandagl', help='display module, pandagl with LIBGL_ALWAYS_SOFTWARE=1 needs no GPU')
+	soakParser.set_defaults(func=benchSoak)
+
+	replayParser = subparsers.add_parser('replay', help='replay the intro headlessly and report frame times')
+	replayParser.add_argument('--quality', default='low', help='the only quality with every intro model')
+	replayParser.add_argument('--display', default='pandagl', help='display module, pandagl with LIBGL_ALWAYS_SOFTWARE=1 needs no GPU')
+	replayParser.add_argument('--walk', action='store_true', help='walk through SceneOne after the intro')
+	replayParser.add_argument('--max-frames', type=int, default=3000)
+	replayParser.add_argument('--output', help='write the results as JSON to this file')
+	replayParser.add_argument('--baseline', help='compare against, or save to, this JSON file')
+	replayParser.add_argument('--save-baseline', action='store_true')
+	replayParser.add_argument('--tolerance', type=float, default=0.15, help='allowed slowdown against the baseline')
+	replayParser.set_defaults(func=benchReplay)
+
+	args = parser.parse_args()
+	args.func(args)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+'''
+
+Offline texture build step for PoultryGeist
+
+Compresses every texture referenced by the models in resources/ into a
+GPU-ready .txo file with precomputed mipmaps, stores a single copy of each
+identical texture in resources/shared/tex and rewrites the models to use it.
+
+'''
+# Import the C++ Panda3D modules
+from panda3d.core import Filename, Loader, LoaderOptions, NodePath
+from panda3d.core import Texture, TexturePool, SamplerState, load_prc_file_data
+from panda3d.egg import EggData, EggGroupNode, EggTexture
+
+import argparse
+import hashlib
+import os
+
+# Write texture paths into the bam files relative to the bam itself
+load_prc_file_data("", """bam-texture-mode relative
+						  textures-power-2 none
+					   """)
+
+RESOURCE_DIR = 'resources'
+SHARED_DIR = os.path.join(RESOURCE_DIR, 'shared', 'tex')
+# Folders that hold models, one for each quality tier
+TIERS = ('generic', 'high', 'low', 'super-low')
+
+class TextureBuilder:
+	'''
+	Builds the shared, compressed copy of each texture and keeps track of
+	which source files have been replaced.
+	'''
+	def __init__(self, dryRun=False):
+		self.dryRun = dryRun
+		# Map the digest of each source file to its shared texture path
+		self.shared = {}
+		# Store the source files that have been replaced
+		self.replaced = set()
+		# Store the size of every source file and every output file
+		self.sourceBytes = 0
+		self.outputBytes = 0
+
+	def getDigest(self, path):
+		'''
+		Hash the contents of a texture file
+		'''
+		sha = hashlib.sha1()
+		with open(path, 'rb') as texFile:
+			for block in iter(lambda: texFile.read(1 << 20), b''):
+				sha.update(block)
+		return sha.hexdigest()
+
+	def build(self, sourcePath):
+		'''
+		Return the path of the shared copy of a texture file, building
+		the compressed copy if it doesn't exist yet.
+		'''
+		sourcePath = os.path.normpath(sourcePath)
+		# Don't touch textures that are already shared
+		if sourcePath.startswith(SHARED_DIR):
+			return sourcePath
+
+		digest = self.getDigest(sourcePath)
+		if sourcePath not in self.replaced:
+			self.replaced.add(sourcePath)
+			self.sourceBytes += os.path.getsize(sourcePath)
+		# Only build each unique texture once, no matter how many tiers use it
+		if digest in self.shared:
+			return self.shared[digest]
+
+		sharedPath = os.path.join(SHARED_DIR, digest+'.txo')
+		self.shared[digest] = sharedPath
+		if not os.path.exists(sharedPath) and not self.dryRun:
+			print("[>] PoultryGeist:\t      Compressing {}".format(sourcePath))
+			self.compress(sourcePath, sharedPath)
+		if os.path.exists(sharedPath):
+			self.outputBytes += os.path.getsize(sharedPath)
+		return sharedPath
+
+	def compress(self, sourcePath, sharedPath):
+		'''
+		Generate the mipmaps and compress a texture, then write it as a .txo
+		'''
+		texture = TexturePool.loadTexture(Filename.fromOsSpecific(sourcePath))
+		texture = texture.makeCopy()
+		# Textures that are already compressed (eg. dds) are stored as they are
+		if texture.getRamImageCompression() == Texture.CM_off:
+			texture.generateRamMipmapImages()
+			texture.setMinfilter(SamplerState.FT_linear_mipmap_linear)
+			# Keep an alpha channel only for the textures that need one
+			hasAlpha = texture.getNumComponents() in (2, 4)
+			texture.compressRamImage(Texture.CM_dxt5 if hasAlpha else Texture.CM_dxt1)
+		os.makedirs(SHARED_DIR, exist_ok=True)
+		texture.write(Filename.fromOsSpecific(sharedPath))
+
+	def rewriteBam(self, modelPath):
+		'''
+		Replace every texture in a bam model with its shared copy
+		'''
+		options = LoaderOptions(LoaderOptions.LFNoCache | LoaderOptions.LFReportErrors)
+		node = Loader.getGlobalPtr().loadSync(Filename.fromOsSpecific(modelPath), options)
+		if node is None:
+			return
+		model = NodePath(node)
+		changed = False
+		for texture in model.findAllTextures():
+			sourcePath = texture.getFullpath().toOsSpecific()
+			if not os.path.isfile(sourcePath):
+				continue
+			sharedPath = self.build(sourcePath)
+			if sharedPath != os.path.normpath(sourcePath) and not self.dryRun:
+				model.replaceTexture(texture, TexturePool.loadTexture(Filename.fromOsSpecific(sharedPath)))
+				changed = True
+		if changed:
+			model.writeBamFile(Filename.fromOsSpecific(modelPath))
+
+	def rewriteEgg(self, modelPath):
+		'''
+		Point every texture reference in an egg model at its shared copy
+		'''
+		egg = EggData()
+		egg.read(Filename.fromOsSpecific(modelPath))
+		modelDir = os.path.dirname(modelPath)
+		changed = False
+		for eggTexture in iterEggTextures(egg):
+			sourcePath = os.path.join(modelDir, eggTexture.getFilename().toOsSpecific())
+			if not os.path.isfile(sourcePath):
+				continue
+			sharedPath = self.build(sourcePath)
+			if sharedPath != os.path.normpath(sourcePath) and not self.dryRun:
+				eggTexture.setFilename(Filename.fromOsSpecific(os.path.relpath(sharedPath, modelDir)))
+				changed = True
+		if changed:
+			egg.writeEgg(Filename.fromOsSpecific(modelPath))
+
+	def prune(self):
+		'''
+		Delete the tier copies of the textures that have been replaced
+		'''
+		for sourcePath in sorted(self.replaced):
+			print("[>] PoultryGeist:\t      Removing {}".format(sourcePath))
+			os.remove(sourcePath)
+
+def iterEggTextures(group):
+	'''
+	Yield every texture entry in an egg group, recursively
+	'''
+	for child in group.getChildren():
+		if isinstance(child, EggTexture):
+			yield child
+		elif isinstance(child, EggGroupNode):
+			yield from iterEggTextures(child)
+
+def findModels():
+	'''
+	Yield the path of every model in each of the quality tiers
+	'''
+	for tier in TIERS:
+		tierDir = os.path.join(RESOURCE_DIR, tier)
+		for fileName in sorted(os.listdir(tierDir)):
+			if fileName.endswith('.bam') or fileName.endswith('.egg'):
+				yield os.path.join(tierDir, fileName)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compress and deduplicate the model textures in resources/')
+	parser.add_argument('--dry-run', action='store_true', help='report the savings without writing anything')
+	parser.add_argument('--prune', action='store_true', help='delete the tier copies of replaced textures')
+	args = parser.parse_args()
+
+	builder = TextureBuilder(args.dry_run)
+	for modelPath in findModels():
+		print("[>] PoultryGeist:\t      Processing {}".format(modelPath))
+		if modelPath.endswith('.bam'):
+			builder.rewriteBam(modelPath)
+		else:
+			builder.rewriteEgg(modelPath)
+
+	if args.prune and not args.dry_run:
+		builder.prune()
+
+	print("[>] PoultryGeist:\t      {} source textures ({:.1f} MB) -> {} shared textures ({:.1f} MB)".format(
+	len(builder.replaced), builder.sourceBytes / 2**20, len(builder.shared), builder.outputBytes / 2**20))
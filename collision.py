@@ -0,0 +1,117 @@
+'''
+
+Collision handling for PoultryGeist
+
+'''
+# Import the C++ Panda3D modules
+from panda3d.core import BitMask32, CollisionTraverser, CollisionNode, CollisionPolygon
+from panda3d.core import GeomPrimitive, GeomVertexReader, NodePath
+
+# The collision masks of each kind of object
+MASK_MAP = BitMask32.bit(1)
+MASK_PLAYER = BitMask32.bit(2)
+MASK_ENTITY = BitMask32.bit(3)
+
+class CollisionWorld:
+	'''
+	Owns the game's single collision traverser. Map colliders are compiled
+	into the scene files by compileCollider. Debug visualisation is only
+	shown in debug mode.
+	'''
+	# The width of each cell of a compiled map collider
+	cellSize = 20
+	# The number of cells along each side of a region of cells
+	regionSize = 4
+
+	def __init__(self, app, debug=False):
+		self.app = app
+		self.debug = debug
+
+		# Create the traverser. It isn't set as base.cTrav, as the scene
+		# manager traverses once per simulation step rather than every frame
+		self.traverser = CollisionTraverser('main_traverser')
+		if debug:
+			self.traverser.showCollisions(app.render)
+
+	def traverse(self):
+		'''
+		Test every moving collider against the scene and run its handler
+		'''
+		self.traverser.traverse(self.app.render)
+
+	def addCollider(self, nodePath, handler, fromMask, intoMask=BitMask32.allOff()):
+		'''
+		Add a moving collider to the traverser, colliding into the given masks
+		'''
+		nodePath.node().setFromCollideMask(fromMask)
+		nodePath.node().setIntoCollideMask(intoMask)
+		self.traverser.addCollider(nodePath, handler)
+		if self.debug:
+			nodePath.show()
+
+	def removeCollider(self, nodePath):
+		'''
+		Remove a moving collider from the traverser
+		'''
+		self.traverser.removeCollider(nodePath)
+
+def iterSolids(source, transform):
+	'''
+	Yield a transformed copy of every collision solid below a node. If there
+	are none, the visible geometry is turned into collision polygons instead.
+	'''
+	collNodePaths = source.findAllMatches('**/+CollisionNode')
+	for collNodePath in collNodePaths:
+		mat = transform.compose(collNodePath.getTransform(source)).getMat()
+		collNode = collNodePath.node()
+		for i in range(collNode.getNumSolids()):
+			solid = collNode.getSolid(i).makeCopy()
+			solid.xform(mat)
+			yield solid
+	if collNodePaths.getNumPaths():
+		return
+
+	for geomNodePath in source.findAllMatches('**/+GeomNode'):
+		mat = transform.compose(geomNodePath.getTransform(source)).getMat()
+		geomNode = geomNodePath.node()
+		for i in range(geomNode.getNumGeoms()):
+			geom = geomNode.getGeom(i).decompose()
+			vertices = GeomVertexReader(geom.getVertexData(), 'vertex')
+			for j in range(geom.getNumPrimitives()):
+				primitive = geom.getPrimitive(j)
+				if primitive.getPrimitiveType() != GeomPrimitive.PT_polygons:
+					continue
+				for k in range(primitive.getNumPrimitives()):
+					points = []
+					for v in range(primitive.getPrimitiveStart(k), primitive.getPrimitiveEnd(k)):
+						vertices.setRow(primitive.getVertex(v))
+						points.append(mat.xformPoint(vertices.getData3()))
+					# Skip degenerate triangles, which can't be made into polygons
+					if CollisionPolygon.verifyPoints(*points):
+						yield CollisionPolygon(*points)
+
+def compileCollider(source, transform, cellSize, regionSize):
+	'''
+	Bake the transform into the collision solids of a model and split them
+	into a two level hierarchy of regions and cells, so the traverser can
+	reject most of the map with a few bounding volume checks
+	'''
+	cells = {}
+	for solid in iterSolids(source, transform):
+		center = solid.getCollisionOrigin()
+		cell = (int(center[0] // cellSize), int(center[1] // cellSize))
+		if cell not in cells:
+			cells[cell] = CollisionNode('map-cell-{}-{}'.format(*cell))
+		cells[cell].addSolid(solid)
+
+	collider = NodePath('map-collider')
+	regions = {}
+	for cell, collNode in cells.items():
+		# Nothing should collide from the map, only into it
+		collNode.setFromCollideMask(BitMask32.allOff())
+		collNode.setIntoCollideMask(MASK_MAP)
+		region = (cell[0] // regionSize, cell[1] // regionSize)
+		if region not in regions:
+			regions[region] = collider.attachNewNode('map-region-{}-{}'.format(*region))
+		regions[region].attachNewNode(collNode)
+	return collider
@@ -0,0 +1,104 @@
+'''
+
+Input actions for PoultryGeist
+
+'''
+# Import the Panda3D Python modules
+from direct.showbase.DirectObject import DirectObject
+
+# The default key for each action, with the minimum seconds between presses
+DEFAULT_BINDINGS = (
+	('forward', 'w', 0),
+	('backward', 's', 0),
+	('print-position', 'l', 0),
+	('switch-scene', 'p', 0.5),
+	('menu-up', 'arrow_up', 0),
+	('menu-down', 'arrow_down', 0),
+	('menu-select', 'enter', 0),
+	)
+
+class InputMap(DirectObject):
+	'''
+	Maps key events to named actions. Press and release callbacks fire once
+	per edge rather than every frame, held actions can be checked at any
+	time, and presses which come too soon after the last one are ignored.
+	'''
+	def __init__(self, bindings=DEFAULT_BINDINGS):
+		# Map each action to its key and debounce time
+		self.bindings = {}
+		self.debounce = {}
+		# Store the actions which are currently held down
+		self.held = set()
+		# Map (action, 'press' or 'release') to the callbacks for that edge
+		self.callbacks = {}
+		# Store the time each action was last pressed
+		self.lastPress = {}
+
+		for action, key, debounce in bindings:
+			self.bind(action, key, debounce)
+
+	def bind(self, action, key, debounce=0):
+		'''
+		Bind a key to an action, replacing any previous key for the action
+		'''
+		if action in self.bindings:
+			self.ignore(self.bindings[action])
+			self.ignore(self.bindings[action]+'-up')
+		self.bindings[action] = key
+		self.debounce[action] = debounce
+		# Panda3D sends the key name on press and key-up on release
+		self.accept(key, self.press, [action])
+		self.accept(key+'-up', self.release, [action])
+
+	def onPress(self, action, callback):
+		'''
+		Call a function once each time an action is pressed
+		'''
+		self.callbacks.setdefault((action, 'press'), []).append(callback)
+
+	def onRelease(self, action, callback):
+		'''
+		Call a function once each time an action is released
+		'''
+		self.callbacks.setdefault((action, 'release'), []).append(callback)
+
+	def removeCallback(self, action, callback):
+		'''
+		Stop calling a function for an action
+		'''
+		for edge in ('press', 'release'):
+			callbacks = self.callbacks.get((action, edge), [])
+			if callback in callbacks:
+				callbacks.remove(callback)
+
+	def isHeld(self, action):
+		'''
+		Check if an action is currently held down
+		'''
+		return action in self.held
+
+	def press(self, action):
+		'''
+		Handle the key for an action being pressed
+		'''
+		# Ignore repeated presses without a release in between
+		if action in self.held:
+			return
+		self.held.add(action)
+		# Ignore presses which come too soon after the last one
+		now = globalClock.getFrameTime()
+		if action in self.lastPress and now - self.lastPress[action] < self.debounce[action]:
+			return
+		self.lastPress[action] = now
+		for callback in list(self.callbacks.get((action, 'press'), [])):
+			callback()
+
+	def release(self, action):
+		'''
+		Handle the key for an action being released
+		'''
+		if action not in self.held:
+			return
+		self.held.discard(action)
+		for callback in list(self.callbacks.get((action, 'release'), [])):
+			callback()
@@ -0,0 +1,95 @@
+'''
+
+Crowd AI for PoultryGeist
+
+'''
+import numpy as np
+
+# The upper distance limit of each range band around the player
+BAND_LIMITS = np.array([5, 8, 11])
+# The range bands, from closest to furthest
+SPRINT, CHASE, NOTICE, IDLE = range(4)
+# The maximum force used by chickens chasing in each band
+CHASE_FORCE = 8
+SPRINT_FORCE = 27
+# The seconds the player must stay in the notice band to escape
+ESCAPE_TIME = 4
+
+class ChickenCrowd:
+	'''
+	Updates the range band state of every chicken in a scene in a single
+	batched pass. Positions, distances and states are kept in arrays, and
+	only the chickens whose state changes are called back into.
+	'''
+	def __init__(self, target):
+		# The nodepath the chickens react to, usually the camera
+		self.target = target
+		self.members = []
+		self.positions = np.zeros((0, 3))
+		# Store the band of each chicken from the last update
+		self.bands = np.zeros(0, dtype=np.int8)
+		self.timeOfEscape = np.zeros(0)
+		# Count the calls made into the chickens on the last update
+		self.reactions = 0
+
+	def add(self, chicken):
+		'''
+		Add a chicken to the crowd
+		'''
+		self.members.append(chicken)
+		self.positions = np.vstack((self.positions, np.zeros((1, 3))))
+		# New chickens start out of range of the player
+		self.bands = np.append(self.bands, np.int8(IDLE))
+		self.timeOfEscape = np.append(self.timeOfEscape, 0)
+
+	def remove(self, chicken):
+		'''
+		Remove a chicken from the crowd
+		'''
+		index = self.members.index(chicken)
+		del self.members[index]
+		self.positions = np.delete(self.positions, index, axis=0)
+		self.bands = np.delete(self.bands, index)
+		self.timeOfEscape = np.delete(self.timeOfEscape, index)
+
+	def update(self, dt):
+		'''
+		Work out the range band of every chicken and react to the changes,
+		dt seconds after the last update
+		'''
+		if not self.members:
+			return
+		# Gather the positions of the chickens relative to the top of the scene graph
+		root = self.target.getTop()
+		for i, chicken in enumerate(self.members):
+			self.positions[i] = chicken.modelNodePath.getPos(root)
+		distances = np.linalg.norm(self.positions - self.target.getPos(root), axis=1)
+		bands = np.searchsorted(BAND_LIMITS, distances).astype(np.int8)
+		last = self.bands
+
+		# Chickens which have just entered the notice band turn to the player
+		inNotice = bands == NOTICE
+		noticed = inNotice & (last != NOTICE)
+		# Time how long the player has stayed out of the chase bands
+		escaping = inNotice & (last >= NOTICE)
+		self.timeOfEscape[escaping] += dt
+		# Reset the timer if the chicken caught up again
+		self.timeOfEscape[inNotice & ~escaping] = 0
+		escaped = escaping & (self.timeOfEscape > ESCAPE_TIME)
+		self.timeOfEscape[escaped] = 0
+
+		# Chickens which have just entered a chase band start chasing
+		chasing = (bands == CHASE) & (last != CHASE)
+		sprinting = (bands == SPRINT) & (last != SPRINT)
+		self.bands = bands
+
+		# Only call into the chickens whose state has changed
+		for i in np.flatnonzero(noticed):
+			self.members[i].notice()
+		for i in np.flatnonzero(escaped):
+			self.members[i].escape()
+		for i in np.flatnonzero(chasing):
+			self.members[i].chase(CHASE_FORCE)
+		for i in np.flatnonzero(sprinting):
+			self.members[i].chase(SPRINT_FORCE)
+		self.reactions = int(noticed.sum() + escaped.sum() + chasing.sum() + sprinting.sum())
@@ -8,42 +8,63 @@ You'll Be Running Chicken
 # Import the Python Panda3D modules
 from direct.showbase.ShowBase import ShowBase
 from direct.task.Task import Task
-from direct.filter.CommonFilters import CommonFilters
-
-# Import the main render pipeline class
-from rpcore import RenderPipeline
 
 import sys
-from copy import deepcopy
+import threading
 from time import sleep
 import math
+import json
 
 #Import the C++ Panda3D modules
-from panda3d.core import WindowProperties, AntialiasAttrib
-from panda3d.core import KeyboardButton, load_prc_file_data
-from panda3d.core import LVector3
+from panda3d.core import WindowProperties, GraphicsWindow, AntialiasAttrib
+from panda3d.core import ConfigVariableInt, ConfigVariableBool, load_prc_file_data
+from panda3d.core import LVector3, NodePath, TP_low
 
 #Import the external files from this project
-from scene import *
+from scene import Scene, MenuScene, IntroScene
+from assets import BamCache, AssetCache
+from profiling import FrameProfiler, StartupProfiler
+from controls import InputMap
+from collision import CollisionWorld
+from warmup import warmUpScene
+from scenefile import SceneCompiler
 
-# from main_menu import *
+# The window size of each resolution setting
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080)}
 
 class Application(ShowBase, object):
 	'''
 	The default Application class which holds the code for
 	Panda3D to run the game
 	'''
-	def __init__(self, quality):
+	def __init__(self, quality, debug=False, options=None, settingsPath=None, startupProfiler=None):
+		# Time the phases of the startup, if the launcher asked for it
+		self.startupProfiler = startupProfiler or StartupProfiler()
 		# Set the model quality, (super-low, low or high)
 		self.quality = quality
+		# Show the debug visualisations, such as the colliders
+		self.debug = debug
+		# Store the settings chosen in the menu, and the file they are saved to
+		self.options = {'audio': 'on', 'resolution': '1080p'}
+		self.options.update(options or {})
+		self.options['quality'] = quality
+		self.settingsPath = settingsPath
 		print("[>] PoultryGeist:\t      Setting Model Resolution to {}".format(
 		self.quality.upper()))
 
-		load_prc_file_data("", "win-size 1920 1080")
+		# Open the window at the chosen resolution
+		load_prc_file_data("", "win-size {} {}".format(*RESOLUTIONS[self.options['resolution']]))
+		# Cache the loaded textures on disk, already compressed, for later launches
+		load_prc_file_data("", """model-cache-dir cache/models
+								  model-cache-textures #t
+								  model-cache-compressed-textures #t
+							   """)
 
 		# Run the standard Showbase init if running in super-low resolution mode
 		# Do some stuff if the game is running at normal or high resolution
 		if self.quality != 'super-low':
+			# Import the main render pipeline class, only needed at this quality
+			from rpcore import RenderPipeline
 			# Construct and create the pipeline
 			self.render_pipeline = RenderPipeline()
 			self.render_pipeline.pre_showbase_init()
@@ -56,12 +77,13 @@ class Application(ShowBase, object):
 
 		else:
 			super(Application, self).__init__()
+			from direct.filter.CommonFilters import CommonFilters
 			# Enable the filter handler
 			self.filters = CommonFilters(base.win, base.cam)
 			self.filters.setAmbientOcclusion()
 
-		# Enable particles and physics
-		self.enableParticles()
+		self.startupProfiler.mark('Renderer')
+		# Particles and physics are enabled by the first scene that uses them
 
 		#Modify the Panda3D config on-the-fly
 		#In this case, edit the window title
@@ -80,57 +102,128 @@ class Application(ShowBase, object):
 		# Turn off normal mouse controls
 		self.disableMouse()
 
+		# Check if the game is rendering into an offscreen buffer, eg. for benchmarks
+		self.isHeadless = not isinstance(self.win, GraphicsWindow)
+
 		# Hide the cursor
 		self.props = WindowProperties()
 		#
 		self.props.setCursorHidden(True)
+		if not self.isHeadless:
+			self.win.requestProperties(self.props)
 		# Lower the FOV to make the game more difficult
-		self.win.requestProperties(self.props)
 		self.camLens.setFov(60)
 		# Reduces the distance of which the camera can render objects close to it
 		self.camLens.setNear(0.1)
-		# Store and empty renderTree for later use
-		self.emptyRenderTree = deepcopy(self.render)
+		# Initialise the cache of binary copies of the egg models
+		self.bamCache = BamCache()
+		# Initialise the shared cache of loaded models, limited to a memory budget
+		self.assetCache = AssetCache(self.loader, ConfigVariableInt('asset-cache-budget-mb', 256).getValue() * 2**20)
+		self.startupProfiler.mark('Asset caches')
+
+		# Stream textures in at the size they are drawn at, within a memory budget
+		if ConfigVariableBool('stream-textures', True).getValue():
+			# Import the streamer only when it is turned on
+			from texstream import TextureStreamer
+			# Leave the textures unread when a model loads, so the streamer picks their size
+			load_prc_file_data("", "preload-textures #f")
+			self.textureStreamer = TextureStreamer(self, ConfigVariableInt('texture-budget-mb', 128).getValue() * 2**20)
+		else:
+			self.textureStreamer = None
+		self.startupProfiler.mark('Texture streamer')
 
-		# Register the buttons for movement
-		# TODO remove this and overhaul the button handling
-		self.w_button = KeyboardButton.ascii_key('w'.encode())
-		self.s_button = KeyboardButton.ascii_key('s'.encode())
-		self.l_button = KeyboardButton.ascii_key('l'.encode())
+		# Store the nodes under render which survive every scene switch
+		self.persistentNodes = [self.camera]
 
-		self.switch_button = KeyboardButton.ascii_key('p'.encode())
+		# Map the keys to the named game actions
+		self.input = InputMap()
 
-		# Initialise the SceneManager
-		self.sceneMgr = SceneManager(self)
+		# Initialise the per-frame stage timers, which cost nothing when disabled
+		self.profiler = FrameProfiler(ConfigVariableBool('profile-frames', False).getValue())
 
-		# Initialise the collision traverser
-		self.collisionTraverser = CollisionTraverser('main_traverser')
-		base.cTrav = self.collisionTraverser
-		base.cTrav.showCollisions(self.render)
+		# Initialise the collision traverser, showing the colliders in debug mode
+		self.collisionWorld = CollisionWorld(self, debug)
+
+		# Initialise the compiler which bakes each scene description into one .bam file
+		self.sceneCompiler = SceneCompiler(self.bamCache)
+
+		# Mute the game if the sound was turned off in the saved settings
+		if self.options['audio'] == 'off':
+			self.disableAllAudio()
+
+		self.startupProfiler.mark('Services')
+
+		# Initialise the SceneManager, which builds the first scene
+		self.sceneMgr = SceneManager(self)
+		self.startupProfiler.mark('First scene')
 
 		# Add the sceneMgr events to run as a task
 		taskMgr.add(self.sceneMgr.runSceneTasks, "scene-tasks")
 
+		# Adjust the quality at runtime to hold the target frame rate, if one is set
+		targetFps = ConfigVariableInt('governor-target-fps', 30).getValue()
+		if targetFps > 0:
+			# Import the governor only when it is turned on
+			from governor import QualityGovernor
+			self.governor = QualityGovernor(self, targetFps)
+		else:
+			self.governor = None
+		self.startupProfiler.mark('Governor')
+
+		# Finish the startup profile once the first frame has been drawn
+		if self.startupProfiler.enabled:
+			taskMgr.add(self.finishStartupProfile, 'startup-profile', sort=51)
+
+	def finishStartupProfile(self, task):
+		'''
+		Report the startup profile after the first frame has been rendered
+		'''
+		# Wait for the draw thread to finish the frame before stopping the clock
+		self.graphicsEngine.syncFrame()
+		self.startupProfiler.mark('First frame')
+		self.startupProfiler.report()
+		return Task.done
+
+	def createSceneRoot(self, name='scene'):
+		'''
+		Create an empty root node for a scene's render tree
+		'''
+		return NodePath(name)
+
+	def addPersistentNode(self, nodePath):
+		'''
+		Keep a node attached to render when the scene is switched
+		'''
+		if nodePath not in self.persistentNodes:
+			self.persistentNodes.append(nodePath)
+
 	def loadSettings(self, options):
 		'''
 		Iterate a dictionary of settings and apply them to the game
 		'''
+		self.options.update(options)
 		# Toggle the audio based on the options
-		if options.get('audio', 'on') == 'off':
-			base.disableAllAudio()
-		windowProperties = WindowProperties()
-		# Set the resolution
-		if options.get('resolution') == '720p':
-			windowProperties.setSize(1280, 720)
-			# Set the app width and height variables
-			self.width, self.height = (1280, 720)
+		if self.options['audio'] == 'off':
+			self.disableAllAudio()
 		else:
-			windowProperties.setSize(1920, 1080)
-			# Set the app width and height variables
-			self.width, self.height = (1920, 1080)
-		# Apply the properties to the window
-		base.win.requestProperties(windowProperties)
+			self.enableAllAudio()
+		# Set the resolution, and the app width and height variables
+		self.width, self.height = RESOLUTIONS[self.options['resolution']]
 		load_prc_file_data('', 'win-size {} {}'.format(self.width, self.height))
+		# Apply the properties to the window
+		if not self.isHeadless:
+			windowProperties = WindowProperties()
+			windowProperties.setSize(self.width, self.height)
+			self.win.requestProperties(windowProperties)
+
+	def saveSettings(self):
+		'''
+		Save the settings, so they are used the next time the game starts
+		'''
+		if self.settingsPath is None:
+			return
+		with open(self.settingsPath, 'w') as settingsFile:
+			json.dump(self.options, settingsFile, indent=4)
 
 	def move(self, forward, dir, elapsed):
 		'''
@@ -148,15 +241,55 @@ class Application(ShowBase, object):
 		for a in self.render.getChildren():
 			print(a)
 
+class PreloadRequest:
+	'''
+	A scene being built on the loading thread. Each call to preloadScene
+	makes a new request, so a build that is no longer wanted can tell.
+	'''
+	def __init__(self, sceneClass):
+		self.sceneClass = sceneClass
+		# The scene, set as soon as it starts building so its progress can be read
+		self.scene = None
+		self.ready = False
+		# Whether the scene has been warmed up on the main thread, ready to swap in
+		self.prepared = False
+		# The exception raised while building the scene, if any
+		self.error = None
+
 class SceneManager:
 	'''
 	The SceneManager to handle the events and tasks of each scene as well as
 	handle scene swapping.
 	'''
+	# The length of each gameplay simulation step in seconds
+	stepSize = 1 / 60
+	# The most simulation steps run in one frame before dropping time. A
+	# quarter of a second keeps gameplay in real time down to 4 fps.
+	maxSteps = 15
+
 	def __init__(self, app):
 		self.app = app
 		self.scene = None
-		self.loadScene(IntroClipScene(app))
+		# Store the frame time which hasn't been simulated yet
+		self.accumulator = 0
+		# Store the camera's drawn position and its last two simulated positions
+		self.cameraSteps = None
+
+		# Set up a thread to build upcoming scenes in the background
+		taskMgr.setupTaskChain('scene-loader', numThreads=1, threadPriority=TP_low)
+		# Store the current preload request, and guard handing it between the threads
+		self.pending = None
+		self.pendingLock = threading.Lock()
+		# Store the scenes built on the loading thread which are no longer
+		# wanted, so they can be released on the main thread
+		self.staleScenes = []
+		# Upload each scene's graphics resources before it is first drawn
+		self.warmUp = ConfigVariableBool('warm-up-scenes', True).getValue()
+		# Store the resources prepared by the last warm-up and the time taken
+		self.warmupStats = None
+
+		# Start the game at the main menu
+		self.loadScene(MenuScene(app))
 
 		# Set the current viewing target
 		self.focus = LVector3(55, -55, 20)
@@ -167,78 +300,272 @@ class SceneManager:
 		self.last = 0
 		self.mousebtn = [0, 0, 0]
 
-	def loadScene(self, scene):
+		# Register the actions which fire once per key press
+		self.app.input.onPress('print-position', self.printPosition)
+		self.app.input.onPress('switch-scene', self.switchScene)
+
+	def loadScene(self, scene, prepared=False):
 		'''
-		Load a new scene into the game
+		Load a new scene into the game. Scenes which haven't been prepared by
+		prepareScene, such as those not preloaded, are prepared first.
 		'''
 		self.sceneFrame = 1
 		# Run the end of scene events
 		if isinstance(self.scene, Scene):
 			self.scene.exitScene()
+			# Free everything the old scene owns
+			self.scene.release()
+		# Drop a preload which isn't the scene being loaded
+		if self.pending is not None and self.pending.scene is not scene:
+			self.cancelPreload()
 
 		# Iterate and detach all of the old nodes
 		for child in self.app.render.getChildren():
-			if not str(child).endswith('camera'):
+			if child not in self.app.persistentNodes:
 				child.detachNode()
 
 		self.scene = scene
-		# Reparent the scene tree to the main render tree
-		for child in self.scene.renderTree.getChildren():
-			if not str(child).endswith('camera'):
-				child.reparentTo(self.app.render)
+		if not prepared:
+			self.prepareScene(scene)
+		# Attach the scene tree to the main render tree
+		self.scene.renderTree.reparentTo(self.app.render)
+		self.scene.applyBackgroundColor()
+		# Match the governor's distance fog to the new scene's own fog
+		# The first scene is loaded before the governor is created
+		if getattr(self.app, 'governor', None) is not None:
+			self.app.governor.applyFog()
 
 		if self.app.quality == 'super-low':
 			# set up auto shaders
 			self.app.render.setShaderAuto()
 
+	def prepareScene(self, scene):
+		'''
+		Run the main thread work of a scene which may have been built on the
+		loading thread, then upload its graphics resources before it is shown
+		'''
+		scene.runDeferred()
+		if self.warmUp:
+			self.warmupStats = warmUpScene(self.app, scene.renderTree, self.app.quality == 'super-low')
+			print("[>] PoultryGeist:\t      Warmed up {} in {:.1f} ms: {textures} textures, {vertexBuffers} vertex buffers, {shaders} shaders".format(
+				type(scene).__name__, self.warmupStats['milliseconds'], **self.warmupStats))
+
+	def preparePending(self):
+		'''
+		Prepare a finished preload while the current scene is still shown,
+		so swapping it in later only takes a cheap frame
+		'''
+		request = self.pending
+		if request is not None and request.ready and not request.prepared:
+			self.prepareScene(request.scene)
+			request.prepared = True
+
+	def preloadScene(self, sceneClass):
+		'''
+		Start building a scene on the background loading thread, so it can
+		be swapped in later without stalling the current scene
+		'''
+		# Don't restart a scene that is already being loaded
+		if self.pending is not None and self.pending.sceneClass is sceneClass:
+			return
+		self.cancelPreload()
+		request = PreloadRequest(sceneClass)
+		self.pending = request
+		print("[>] PoultryGeist:\t      Preloading {}".format(sceneClass.__name__))
+		taskMgr.add(self.buildScene, 'scene-preload', extraArgs=[request], taskChain='scene-loader')
+
+	def cancelPreload(self):
+		'''
+		Drop the current preload request. A finished scene is released on the
+		next frame, and one still building is released once it is done.
+		'''
+		with self.pendingLock:
+			request = self.pending
+			self.pending = None
+			if request is not None and request.ready:
+				self.staleScenes.append(request.scene)
+
+	def buildScene(self, request):
+		'''
+		Construct a scene on the loading thread
+		'''
+		sceneClass = request.sceneClass
+		# Create the object before running the constructor so the progress can be read
+		scene = sceneClass.__new__(sceneClass)
+		request.scene = scene
+		try:
+			scene.__init__(self.app)
+		except Exception as error:
+			# Hand the error to the main thread, which reports it when the scene is wanted
+			print("[>] PoultryGeist:\t      Failed to preload {}: {}".format(sceneClass.__name__, error))
+			request.error = error
+			# Free whatever the scene built, once the base Scene set up its release
+			if hasattr(scene, 'deferred'):
+				self.staleScenes.append(scene)
+			return
+		# Only flag the scene as ready if it is still the request being waited on
+		with self.pendingLock:
+			if self.pending is request:
+				request.ready = True
+				print("[>] PoultryGeist:\t      Finished preloading {}".format(sceneClass.__name__))
+			else:
+				self.staleScenes.append(scene)
+
+	def releaseStaleScenes(self):
+		'''
+		Release the preloaded scenes which are no longer wanted, on the main thread
+		'''
+		while self.staleScenes:
+			self.staleScenes.pop().release()
+
+	def getLoadProgress(self):
+		'''
+		Get the fraction of the preloading scene that has been built
+		'''
+		request = self.pending
+		if request is None or request.scene is None:
+			return 0.0
+		if request.ready:
+			return 1.0
+		# Estimate the progress from the number of models added so far
+		loaded = len(getattr(request.scene, 'models', {}))
+		return min(loaded / request.sceneClass.loadEstimate, 0.99)
+
+	def switchToPreloaded(self, sceneClass):
+		'''
+		Swap in a preloaded scene if it has finished loading.
+		Returns True if the scene was switched.
+		'''
+		# Begin loading the scene if it hasn't been requested yet
+		if self.pending is None or self.pending.sceneClass is not sceneClass:
+			self.preloadScene(sceneClass)
+		request = self.pending
+		# Raise the error from the loading thread, rather than waiting forever
+		if request.error is not None:
+			self.pending = None
+			raise RuntimeError("Couldn't load {}".format(sceneClass.__name__)) from request.error
+		if not request.prepared:
+			return False
+
+		self.pending = None
+		self.loadScene(request.scene, prepared=True)
+		return True
+
 	def runSceneTasks(self, task):
 		'''
 		Run the event update for the current scene
 		'''
+		# Free the unwanted scenes the loading thread has finished with, and
+		# warm up a finished preload before it is swapped in
+		self.releaseStaleScenes()
+		self.preparePending()
+
 		if self.sceneFrame == 2:
 			# Run the scene events immediately after loading the scene
 			self.scene.initScene()
 
+		profiler = self.app.profiler
+		profiler.begin('SceneTasks:Camera')
 		if self.scene.isPlayerControlled:
 			# Run the camera control task if the scene allows for it
 			self.controlCamera(task)
 		else:
 			# Bob the camera aggresively if using a predetermined motion path
 			self.bobCamera(task, 15)
+		profiler.end('SceneTasks:Camera')
 
-		self.handleButtons(task)
+		profiler.begin('SceneTasks:Simulation')
+		self.runSimulation(globalClock.getDt())
+		profiler.end('SceneTasks:Simulation')
 
+		profiler.begin('SceneTasks:Window')
 		# Update the width and height of the window in case it gets resized
 		self.app.width = self.app.win.getXSize()
 		self.app.height = self.app.win.getYSize()
+		profiler.end('SceneTasks:Window')
 
 		# Iterate the current frame
 		self.sceneFrame += 1
 		# Store the frame time for the next loop
 		self.last = task.time
-		# Run the scenes standard events
-		return self.scene.eventRun(task)
-
-	def handleButtons(self, task):
-		elapsed = task.time - self.last
+		# Run the shared scene systems, then the scenes standard events
+		profiler.begin('SceneTasks:Services')
+		self.scene.updateServices(task)
+		profiler.end('SceneTasks:Services')
+		profiler.begin('SceneTasks:Events')
+		result = self.scene.eventRun(task)
+		profiler.end('SceneTasks:Events')
+		profiler.endFrame()
+		return result
+
+	def runSimulation(self, elapsed):
+		'''
+		Run as many fixed simulation steps as fit in the elapsed frame time,
+		then place the simulated nodes between their last two steps
+		'''
+		interpolated = self.scene.interpolated
+		# Put the nodes back at their simulated positions before stepping
+		for entry in interpolated:
+			entry[0].setPos(entry[2])
+		camera = self.app.camera
+		# Put the camera back too, unless something else has moved it since it was drawn
+		if self.cameraSteps is not None and camera.getPos() == self.cameraSteps[0]:
+			camera.setPos(self.cameraSteps[2])
+		else:
+			self.cameraSteps = [None, camera.getPos(), camera.getPos()]
+
+		self.accumulator += elapsed
+		steps = 0
+		while self.accumulator >= self.stepSize and steps < self.maxSteps:
+			for entry in interpolated:
+				entry[1] = entry[0].getPos()
+			self.cameraSteps[1] = camera.getPos()
+			self.handleButtons(self.stepSize)
+			self.scene.simulate(self.stepSize)
+			# Push the moved colliders out of the map once per step
+			self.app.collisionWorld.traverse()
+			for entry in interpolated:
+				entry[2] = entry[0].getPos()
+			self.cameraSteps[2] = camera.getPos()
+			self.accumulator -= self.stepSize
+			steps += 1
+		# Drop the time a slow frame couldn't catch up on, rather than spiralling
+		if steps == self.maxSteps:
+			self.accumulator = min(self.accumulator, self.stepSize)
+
+		# Draw the nodes and camera part way between their last two simulated positions
+		alpha = self.accumulator / self.stepSize
+		for nodePath, previous, current in interpolated:
+			nodePath.setPos(previous + (current - previous) * alpha)
+		previous, current = self.cameraSteps[1:]
+		camera.setPos(previous + (current - previous) * alpha)
+		self.cameraSteps[0] = camera.getPos()
+
+	def handleButtons(self, elapsed):
+		'''
+		Move the camera while the movement keys are held
+		'''
 		# Get a 3D vector of the camera's direction
 		dir = self.app.camera.getMat().getRow3(1)
-		# Alias the really long function to a short name
-		is_down = base.mouseWatcherNode.is_button_down
-		# Check for a w press and move forward
-		if is_down(self.app.w_button):
+		# Move forward while w is held
+		if self.app.input.isHeld('forward'):
 			# Make the camera bob slightly
 			self.app.move(True, dir, elapsed)
-		# Check for an s press and move backwards
-		if is_down(self.app.s_button):
+		# Move backwards while s is held
+		if self.app.input.isHeld('backward'):
 			self.app.move(False, dir, elapsed)
-		# Check for an s press and move backwards
-		if is_down(self.app.l_button):
-			print(self.app.camera.getPos())
-		# Check for a scene switch and switch the scene
-		if is_down(self.app.switch_button):
-			self.loadScene(MenuScene(self.app) if isinstance(self.scene, IntroScene) else IntroScene(self.app))
 
+	def printPosition(self):
+		'''
+		Print the position of the camera, once per press
+		'''
+		print(self.app.camera.getPos())
+
+	def switchScene(self):
+		'''
+		Switch between the scenes, once per press
+		'''
+		self.loadScene(MenuScene(self.app) if isinstance(self.scene, IntroScene) else IntroScene(self.app))
 
 	def controlCamera(self, task):
 		'''
@@ -246,15 +573,17 @@ class SceneManager:
 		'''
 		# Get the change in time since the previous frame
 		elapsed = task.time - self.last
-		# Get the cursor and X, Y position of it
-		mousePos = self.app.win.getPointer(0)
-		x = mousePos.getX()
-		y = mousePos.getY()
-		# Get the change in mouse position
-		if self.app.win.movePointer(0, int(self.app.width/2), int(self.app.height/2)):
-			# And set the heading and pitch accordingly
-			self.heading = self.heading - (x - self.app.width//2) * 0.2
-			self.pitch = self.pitch - (y - self.app.height//2) * 0.2
+		# Offscreen buffers have no mouse pointer to read
+		if not self.app.isHeadless:
+			# Get the cursor and X, Y position of it
+			mousePos = self.app.win.getPointer(0)
+			x = mousePos.getX()
+			y = mousePos.getY()
+			# Get the change in mouse position
+			if self.app.win.movePointer(0, int(self.app.width/2), int(self.app.height/2)):
+				# And set the heading and pitch accordingly
+				self.heading = self.heading - (x - self.app.width//2) * 0.2
+				self.pitch = self.pitch - (y - self.app.height//2) * 0.2
 
 		# Limit the camera pitch
 		if self.pitch < -75:
@@ -284,4 +613,4 @@ class SceneManager:
 if __name__ == '__main__':
 	# Run the application
 	# MainMenu(Application).run()
-	Application('super-low').run()
+	Application('super-low', debug=True).run()
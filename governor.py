@@ -0,0 +1,154 @@
+'''
+
+Adaptive quality governor for PoultryGeist
+
+'''
+# Import the Panda3D Python modules
+from direct.task.Task import Task
+
+# Import the C++ Panda3D modules
+from panda3d.core import AntialiasAttrib, Fog
+
+import math
+
+# The quality levels, from the cheapest to the best looking
+LEVELS = (
+	{'name': 'minimum', 'antialias': False, 'ambientOcclusion': False, 'viewDistance': 60, 'lodScale': 0.5},
+	{'name': 'reduced', 'antialias': False, 'ambientOcclusion': False, 'viewDistance': 120, 'lodScale': 0.75},
+	{'name': 'medium', 'antialias': True, 'ambientOcclusion': False, 'viewDistance': 250, 'lodScale': 1},
+	{'name': 'full', 'antialias': True, 'ambientOcclusion': True, 'viewDistance': 1000, 'lodScale': 1},
+	)
+
+class QualityGovernor:
+	'''
+	Watches the smoothed frame time and steps the quality settings up or
+	down to hold a target frame rate. Separate thresholds, hold times and a
+	cooldown after every change stop the quality from flickering.
+	'''
+	# How quickly the smoothed frame time follows the real one
+	smoothing = 0.05
+	# Step down below this fraction of the target, and up above the other
+	lowerThreshold = 0.9
+	upperThreshold = 1.25
+	# The seconds the frame rate must stay past a threshold before stepping
+	downHold = 2
+	upHold = 6
+	# The seconds to wait after a change before judging the frame rate again
+	cooldown = 3
+	# The fraction of the scene still seen through the fog at the view distance
+	fogVisibility = 0.02
+
+	def __init__(self, app, targetFps=30):
+		self.app = app
+		self.targetFps = targetFps
+		# Start at the best quality and work down if needed
+		self.level = len(LEVELS) - 1
+		self.frameTime = 1 / targetFps
+		# The time the frame rate first went past each threshold
+		self.slowSince = None
+		self.fastSince = None
+		self.lastChange = 0
+		# Store every change as (time, old level, new level, smoothed fps)
+		self.history = []
+
+		self.applyLevel(LEVELS[self.level])
+		app.taskMgr.add(self.update, 'quality-governor')
+
+	def getFps(self):
+		'''
+		Get the smoothed frame rate
+		'''
+		return 1 / self.frameTime if self.frameTime > 0 else 0
+
+	def update(self, task):
+		'''
+		Smooth the frame time and change the quality level if needed
+		'''
+		dt = globalClock.getDt()
+		self.frameTime += (dt - self.frameTime) * self.smoothing
+		fps = self.getFps()
+		now = task.time
+
+		# Let the frame rate settle after a change
+		if now - self.lastChange < self.cooldown:
+			return Task.cont
+
+		# Track how long the frame rate has been too low or high
+		if fps < self.targetFps * self.lowerThreshold:
+			self.slowSince = now if self.slowSince is None else self.slowSince
+		else:
+			self.slowSince = None
+		if fps > self.targetFps * self.upperThreshold:
+			self.fastSince = now if self.fastSince is None else self.fastSince
+		else:
+			self.fastSince = None
+
+		if self.slowSince is not None and now - self.slowSince > self.downHold and self.level > 0:
+			self.setLevel(self.level - 1, now)
+		elif self.fastSince is not None and now - self.fastSince > self.upHold and self.level < len(LEVELS) - 1:
+			self.setLevel(self.level + 1, now)
+		return Task.cont
+
+	def setLevel(self, level, now):
+		'''
+		Switch to a new quality level and log the change
+		'''
+		print("[>] PoultryGeist:\t      Quality governor: {} -> {} at {:.1f} fps".format(
+		LEVELS[self.level]['name'], LEVELS[level]['name'], self.getFps()))
+		self.history.append((now, self.level, level, self.getFps()))
+		self.level = level
+		self.lastChange = now
+		self.slowSince = None
+		self.fastSince = None
+		self.applyLevel(LEVELS[level])
+
+	def applyLevel(self, settings):
+		'''
+		Apply the settings of a quality level to the game
+		'''
+		self.app.render.setAntialias(AntialiasAttrib.MAuto if settings['antialias'] else AntialiasAttrib.MNone)
+		# Stop drawing anything past the view distance, fading it out with fog first.
+		# The RenderPipeline ignores Panda3D's fog, so there only the LOD scale is used.
+		if self.app.quality == 'super-low':
+			self.app.camLens.setFar(settings['viewDistance'])
+			self.applyFog()
+		# Scale the LOD switch distances, so cheaper tiers are used sooner
+		self.app.camNode.setLodScale(settings['lodScale'])
+		# The filter based ambient occlusion is only used in super-low mode
+		if self.app.quality == 'super-low':
+			if settings['ambientOcclusion']:
+				self.app.filters.setAmbientOcclusion()
+			else:
+				self.app.filters.delAmbientOcclusion()
+
+	def applyFog(self):
+		'''
+		Thicken the fog so the scene fades out before the view distance,
+		rather than being clipped by the far plane in plain view. Scenes
+		with their own fog keep its colour, and any thicker density.
+		'''
+		# Only the super-low renderer draws Panda3D's fog
+		if self.app.quality != 'super-low':
+			return
+		viewDistance = LEVELS[self.level]['viewDistance']
+		# The best level draws everything, so leave the scene's own fog alone
+		if self.level == len(LEVELS) - 1:
+			self.app.render.clearFog()
+			return
+
+		# Pick the density at which only a trace of the scene is left at the view distance
+		density = -math.log(self.fogVisibility) / viewDistance
+		color = self.app.getBackgroundColor()
+		sceneMgr = getattr(self.app, 'sceneMgr', None)
+		sceneFog = None
+		if sceneMgr is not None and sceneMgr.scene is not None and sceneMgr.scene.renderTree.hasFog():
+			sceneFog = sceneMgr.scene.renderTree.getFog()
+		if sceneFog is not None:
+			color = sceneFog.getColor()
+			density = max(density, sceneFog.getExpDensity())
+
+		fog = Fog('governor-fog')
+		fog.setColor(color)
+		fog.setExpDensity(density)
+		# Override the fog the scene sets on its own render tree
+		self.app.render.setFog(fog, 1)
@@ -0,0 +1,139 @@
+'''
+
+Portal occlusion culling for PoultryGeist
+
+'''
+# Import the C++ Panda3D modules
+from panda3d.core import GeomNode, Point2, Point3
+
+import json
+
+class PortalCuller:
+	'''
+	Splits the geometry of an indoor map into rooms and, each frame, only
+	draws the rooms which can be seen from the camera's room through a
+	chain of portals. Rooms are boxes and portals are quads between two
+	rooms, read from a JSON file in the scene's coordinates:
+
+	{"rooms": {"name": [[minX, minY, minZ], [maxX, maxY, maxZ]], ...},
+	 "portals": [{"rooms": ["name", "name"], "points": [[x, y, z], ...]}, ...],
+	 "viewpoints": [{"pos": [x, y, z], "hpr": [h, p, r]}, ...]}
+
+	The viewpoints are optional, and are used by the occlusion benchmark.
+	'''
+	def __init__(self, path, root, cam):
+		self.root = root
+		# The camera nodepath, with the lens used to project the portals
+		self.cam = cam
+		with open(path) as cellFile:
+			data = json.load(cellFile)
+		self.viewpoints = data.get('viewpoints', [])
+		self.bounds = {name: (Point3(*box[0]), Point3(*box[1])) for name, box in data['rooms'].items()}
+		# Map each room to a list of (neighbouring room, portal points)
+		self.portals = {name: [] for name in self.bounds}
+		for portal in data['portals']:
+			points = [Point3(*point) for point in portal['points']]
+			first, second = portal['rooms']
+			self.portals[first].append((second, points))
+			self.portals[second].append((first, points))
+
+		# Create a node for each room, and one for geometry outside every room
+		self.rooms = {name: root.attachNewNode(GeomNode('room-'+name)) for name in self.bounds}
+		self.shared = root.attachNewNode(GeomNode('room-shared'))
+		self.visible = set(self.rooms)
+		# The number of Geoms in the rooms drawn on the last update, which is
+		# the most draw calls the map can need
+		self.drawCalls = 0
+
+	def getTotalGeoms(self):
+		'''
+		Get the number of Geoms in the whole map
+		'''
+		return self.shared.node().getNumGeoms() + sum(room.node().getNumGeoms() for room in self.rooms.values())
+
+	def findRoom(self, pos):
+		'''
+		Get the name of the room containing a position, or None
+		'''
+		for name, (low, high) in self.bounds.items():
+			if all(low[i] <= pos[i] <= high[i] for i in range(3)):
+				return name
+		return None
+
+	def addModel(self, model):
+		'''
+		Move every Geom of a model into the room containing its centre,
+		baking the model's transform and render state into the copy
+		'''
+		for geomNodePath in model.findAllMatches('**/+GeomNode'):
+			geomNode = geomNodePath.node()
+			mat = geomNodePath.getMat(self.root)
+			state = geomNodePath.getState(self.root)
+			for i in range(geomNode.getNumGeoms()):
+				geom = geomNode.getGeom(i).makeCopy()
+				geom.transformVertices(mat)
+				room = self.findRoom(geom.getBounds().getApproxCenter())
+				target = self.rooms[room] if room is not None else self.shared
+				target.node().addGeom(geom, state.compose(geomNode.getGeomState(i)))
+		model.removeNode()
+
+	def getScreenRect(self, points):
+		'''
+		Get the screen rectangle covered by a portal, as (left, right, bottom,
+		top), or None if any corner is off the screen or behind the camera
+		'''
+		lens = self.cam.node().getLens()
+		xs, ys = [], []
+		for point in points:
+			projected = Point2()
+			if not lens.project(self.cam.getRelativePoint(self.root, point), projected):
+				return None
+			xs.append(projected[0])
+			ys.append(projected[1])
+		return (min(xs), max(xs), min(ys), max(ys))
+
+	def update(self):
+		'''
+		Show the rooms visible through the portals and hide the rest
+		'''
+		start = self.findRoom(self.cam.getPos(self.root))
+		# Draw everything if the camera is outside all of the rooms
+		if start is None:
+			visible = set(self.rooms)
+		else:
+			# Store the screen rectangle each room is seen through, merged over every path to it
+			views = {start: (-1, 1, -1, 1)}
+			# Walk out through the portals, narrowing the view through each one,
+			# and only stepping back into rooms already on the current path
+			queue = [(start, (-1, 1, -1, 1), (start,))]
+			while queue:
+				room, rect, path = queue.pop()
+				for neighbour, points in self.portals[room]:
+					if neighbour in path:
+						continue
+					portalRect = self.getScreenRect(points)
+					# A portal that can't be fully projected keeps the parent's view
+					if portalRect is None:
+						portalRect = rect
+					narrowed = (max(rect[0], portalRect[0]), min(rect[1], portalRect[1]), max(rect[2], portalRect[2]), min(rect[3], portalRect[3]))
+					if narrowed[0] >= narrowed[1] or narrowed[2] >= narrowed[3]:
+						continue
+					view = views.get(neighbour)
+					# Skip paths which don't show any more of a room than is already seen
+					if view is not None and view[0] <= narrowed[0] and narrowed[1] <= view[1] and view[2] <= narrowed[2] and narrowed[3] <= view[3]:
+						continue
+					if view is None:
+						views[neighbour] = narrowed
+					else:
+						views[neighbour] = (min(view[0], narrowed[0]), max(view[1], narrowed[1]), min(view[2], narrowed[2]), max(view[3], narrowed[3]))
+					# Continue through this path's own view, so the rooms beyond are seen through it
+					queue.append((neighbour, narrowed, path + (neighbour,)))
+			visible = set(views)
+
+		# Only change the rooms whose visibility has changed
+		for name in visible - self.visible:
+			self.rooms[name].show()
+		for name in self.visible - visible:
+			self.rooms[name].hide()
+		self.visible = visible
+		self.drawCalls = self.shared.node().getNumGeoms() + sum(self.rooms[name].node().getNumGeoms() for name in visible)
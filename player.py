@@ -1,6 +1,7 @@
-# Import image postprocessin operations
-from direct.filter.CommonFilters import CommonFilters
-from panda3d.core import *
+# Import the C++ Panda3D modules
+from panda3d.core import CollisionBox, CollisionHandlerPusher, CollisionNode, Point3
+
+from collision import MASK_MAP, MASK_PLAYER
 
 class Player:
     def __init__(self, app):
@@ -19,7 +20,7 @@ class Player:
             self.pos = (x, y, z)
         self.nodePath.setPos(*self.pos)
 
-    def addToScene(self):
+    def addToScene(self, scene):
         '''
         Initialise the player in the currently loaded scene.
         '''
@@ -30,11 +31,10 @@ class Player:
         self.app.camera.setPos(*pos)
 
         # Set up the collider shape around the camera
-        self.colliderNodePath = self.app.render.attachNewNode(CollisionNode('playerCollNode'))
+        self.colliderNodePath = scene.renderTree.attachNewNode(CollisionNode('playerCollNode'))
         # Create a new collider box
         self.collider = CollisionBox(Point3(pos[0], pos[1], pos[2]-2), 0.4, 0.4, 2)
         self.colliderNodePath.node().addSolid(self.collider)
-        self.colliderNodePath.show()
         # Set up the collider ray for gravity
         # self.ray = CollisionRay(0, 0, 0, 0, 0, -1)
         # self.colliderNodePath.node().addSolid(self.ray)
@@ -45,7 +45,7 @@ class Player:
         # self.gravity = CollisionHandlerFloor()
         # self.gravity.addCollider(self.colliderNodePath, self.app.camera)
 
-        # Register the collision handlers with the collision traverser
-        self.app.collisionTraverser.addCollider(self.colliderNodePath, self.pusher)
-        # self.app.collisionTraverser.addCollider(self.colliderNodePath, self.gravity)
+        # Register the collision handlers with the collision traverser, colliding only into the map
+        scene.addCollider(self.colliderNodePath, self.pusher, MASK_MAP, MASK_PLAYER)
+        # scene.addCollider(self.colliderNodePath, self.gravity, MASK_MAP, MASK_PLAYER)
 
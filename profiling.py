@@ -0,0 +1,126 @@
+'''
+
+Frame profiling for PoultryGeist
+
+'''
+# Import the C++ Panda3D modules
+from panda3d.core import PStatCollector
+
+from collections import deque
+from time import perf_counter
+
+class FrameProfiler:
+	'''
+	Times named stages of each frame. Every stage feeds a PStats collector
+	of the same name, and the stage times of recent frames are kept in a
+	ring buffer for tests and benchmarks. When disabled, every call returns
+	straight away.
+	'''
+	def __init__(self, enabled=False, size=600):
+		self.enabled = enabled
+		# Store the stage times, in seconds, of the most recent frames
+		self.frames = deque(maxlen=size)
+		# Map each stage name to its PStats collector and start time
+		self.collectors = {}
+		self.starts = {}
+		# The stage times of the frame in progress
+		self.current = {}
+
+	def begin(self, name):
+		'''
+		Start timing a stage
+		'''
+		if not self.enabled:
+			return
+		collector = self.collectors.get(name)
+		if collector is None:
+			# PStats shows the parts of the name split by ':' as a hierarchy
+			collector = self.collectors[name] = PStatCollector('App:'+name)
+		collector.start()
+		self.starts[name] = perf_counter()
+
+	def end(self, name):
+		'''
+		Stop timing a stage
+		'''
+		if not self.enabled:
+			return
+		elapsed = perf_counter() - self.starts.pop(name)
+		self.collectors[name].stop()
+		# A stage may run more than once in a frame
+		self.current[name] = self.current.get(name, 0) + elapsed
+
+	def endFrame(self):
+		'''
+		Store the stage times of the finished frame in the ring buffer
+		'''
+		if not self.enabled:
+			return
+		self.frames.append(self.current)
+		self.current = {}
+
+	def getFrames(self):
+		'''
+		Get the stage times of the frames in the ring buffer, oldest first
+		'''
+		return list(self.frames)
+
+	def getSummary(self):
+		'''
+		Get the mean and worst time of each stage in milliseconds
+		'''
+		summary = {}
+		names = set(name for frame in self.frames for name in frame)
+		for name in sorted(names):
+			times = [frame.get(name, 0) * 1000 for frame in self.frames]
+			summary[name] = {'mean': sum(times) / len(times), 'worst': max(times)}
+		return summary
+
+class StartupProfiler:
+	'''
+	Times the phases of the game's startup, from when the profiler is
+	created to the first rendered frame. Each phase runs from the end of
+	the one before it. When disabled, every call returns straight away.
+	'''
+	def __init__(self, enabled=False, budget=None):
+		self.enabled = enabled
+		# The most milliseconds the whole startup should take, if there is a limit
+		self.budget = budget
+		self.start = self.last = perf_counter()
+		# Store the (name, seconds) of each finished phase, in order
+		self.phases = []
+
+	def mark(self, name):
+		'''
+		Finish timing a phase
+		'''
+		if not self.enabled:
+			return
+		now = perf_counter()
+		self.phases.append((name, now - self.last))
+		self.last = now
+
+	def getTotal(self):
+		'''
+		Get the milliseconds from the start to the end of the last phase
+		'''
+		return (self.last - self.start) * 1000
+
+	def isOverBudget(self):
+		'''
+		Check if the startup took longer than the budget
+		'''
+		return self.budget is not None and self.getTotal() > self.budget
+
+	def report(self):
+		'''
+		Print the time of each phase and the total
+		'''
+		if not self.enabled:
+			return
+		print("[>] PoultryGeist:\t      Startup profile")
+		for name, elapsed in self.phases:
+			print("[>] PoultryGeist:\t      {:<20} {:>9.1f} ms".format(name, elapsed * 1000))
+		print("[>] PoultryGeist:\t      {:<20} {:>9.1f} ms".format('Total', self.getTotal()))
+		if self.isOverBudget():
+			print("[>] PoultryGeist:\t      Startup is over the budget of {} ms".format(self.budget))
@@ -0,0 +1,38 @@
+#version 330
+
+// Lights instanced chunks like the super-low auto shader: ambient and
+// diffuse lighting with exponential fog
+
+uniform sampler2D p3d_Texture0;
+uniform vec4 p3d_ColorScale;
+uniform struct {
+	vec4 ambient;
+} p3d_LightModel;
+uniform struct {
+	vec4 color;
+	vec4 position;
+} p3d_LightSource[4];
+uniform struct {
+	vec4 color;
+	float density;
+} p3d_Fog;
+
+in vec2 texcoord;
+in vec3 normal;
+in vec3 viewPos;
+
+out vec4 fragColor;
+
+void main() {
+	vec4 color = texture(p3d_Texture0, texcoord) * p3d_ColorScale;
+	vec3 light = p3d_LightModel.ambient.rgb;
+	for (int i = 0; i < 4; ++i) {
+		// Directional lights have a w of zero, so their position is the direction
+		vec3 direction = p3d_LightSource[i].position.xyz - viewPos * p3d_LightSource[i].position.w;
+		light += p3d_LightSource[i].color.rgb * max(dot(normalize(normal), normalize(direction)), 0.0);
+	}
+	color.rgb *= light;
+	// Unfogged scenes have a density of zero
+	float fog = exp(-p3d_Fog.density * length(viewPos));
+	fragColor = vec4(mix(p3d_Fog.color.rgb, color.rgb, fog), color.a);
+}
@@ -0,0 +1,25 @@
+#version 330
+
+// Draws each instance of a batched chunk at its offset from the chunk
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
+// The offset of each instance, one texel per instance
+uniform samplerBuffer InstanceOffsets;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec2 p3d_MultiTexCoord0;
+
+out vec2 texcoord;
+out vec3 normal;
+out vec3 viewPos;
+
+void main() {
+	vec4 vertex = p3d_Vertex + vec4(texelFetch(InstanceOffsets, gl_InstanceID).xyz, 0);
+	gl_Position = p3d_ModelViewProjectionMatrix * vertex;
+	viewPos = (p3d_ModelViewMatrix * vertex).xyz;
+	normal = p3d_NormalMatrix * p3d_Normal;
+	texcoord = p3d_MultiTexCoord0;
+}
@@ -1,30 +1,66 @@
 # Import the Panda3D Python modules
 from direct.task.Task import Task
 from direct.gui.OnscreenImage import OnscreenImage
-from direct.gui.DirectGui import *
-from direct.actor.Actor import Actor
+from direct.gui.OnscreenText import OnscreenText
+from direct.gui.DirectGui import DirectFrame
 
 # Import the Panda3D C++ modules
-from panda3d.core import *
-# from panda3d.core import TransparencyAttrib, Vec3, Fog, LPoint3, VBase4, BitMask32
-# from panda3d.core import AmbientLight, DirectionalLight
-# from panda3d.core import WindowProperties,
-from panda3d.physics import *
-from panda3d.ai import *
+from panda3d.core import CollisionNode, Fog
+from panda3d.core import TransparencyAttrib, Vec3, WindowProperties
+from panda3d.ai import AIWorld
 
-# Import the RenderPipeline modules
-from rpcore.util.movement_controller import MovementController
+from entity import Chicken
+from player import Player
+from spatial import AIActivator
+from animation import AnimationLOD
+from assets import countTriangles
+from scenefile import LOD_DISTANCES, applyInstancing
 
-from copy import deepcopy
-
-from entity import *
-from player import *
+import json
+import os
 
 class Scene:
 	'''
 	Holds all of the required details about a scene of the game. Including tasks
 	and render tree for Panda3D.
 	'''
+	# The number of models the scene adds, used to estimate loading progress
+	loadEstimate = 1
+	# The distances at which the camera switches between the LOD tiers of
+	# the scene description's models, which scenes can override
+	lodDistances = LOD_DISTANCES
+
+	def __init__(self, app, isPlayerControlled=False):
+		'''
+		Set up the details shared by every scene
+		'''
+		self.app = app
+		self.isPlayerControlled = isPlayerControlled
+		self.models = {}
+		self.loader = app.loader
+		# Create a fresh root node for the scene's render tree
+		self.renderTree = app.createSceneRoot(type(self).__name__)
+		# Animate the scene's Actors at a rate based on distance and visibility
+		self.animationLOD = AnimationLOD(app.cam)
+		# Cull the scene's rooms through their portals, for scenes that set it up
+		self.occlusion = None
+		# Stream the map in cells around the camera, for scenes that set it up
+		self.streamer = None
+		# Play the scene's positional sounds, for scenes that set it up
+		self.audio = None
+		# Store the simulated nodes which are drawn between simulation steps
+		# Each entry is [nodepath, previous position, current position]
+		self.interpolated = []
+		# Store the tasks the scene has started, and the (function, arguments)
+		# which release everything else it owns outside its render tree
+		self.tasks = []
+		self.cleanups = []
+		# Store the (function, arguments) which must run on the main thread,
+		# run once the scene is loaded as it may be built on the loading thread
+		self.deferred = []
+		# The window's background colour while the scene is shown, or None to leave it
+		self.backgroundColor = None
+
 	def addObject(self, modelName, pos=(0,0,0), scale=(1,1,1), instanceTo=None, isActor=False, key=None, anims={}, parent=None, isGeneric=False, hasPhysics=False, collider=None):
 		'''
 		Adds a model to the Scenes render tree
@@ -36,11 +72,16 @@ class Scene:
 		if instanceTo is None:
 			# Load the model into the engine
 			model = self.loadModel(modelName, isActor, anims)
+			if isActor:
+				self.animationLOD.register(model)
 			# Set the position and scale of the model
 			model.setPos(*pos)
 			model.setScale(*scale)
 			# If physics need to be enabled, parent the object below a physics actor node
 			if hasPhysics:
+				# Only load and start the physics system once a scene needs it
+				from panda3d.physics import ActorNode
+				self.app.enableParticles()
 				actorNode = ActorNode("physics-node-"+modelName)
 				# Parent to the chosen parent, either existing nodepath or the scene graph
 				if parent is None:
@@ -64,9 +105,13 @@ class Scene:
 		# Add the model to the scenes model dictionary
 		self.models[key if key is not None else len(self.models)] = model
 
+		# Load the model's textures small, and let them grow as they are needed
+		if self.app.textureStreamer is not None:
+			self.defer(self.app.textureStreamer.register, model)
+
 		# If the game is running under the RenderPipeline, initialise the model
 		if self.app.quality != 'super-low' and modelName.endswith('.bam'):
-			self.app.render_pipeline.prepare_scene(model)
+			self.defer(self.app.render_pipeline.prepare_scene, model)
 
 		# Return the model nodepath
 		return model
@@ -88,6 +133,49 @@ class Scene:
 		# Return the nodepath
 		return model
 
+	def loadDescription(self, name):
+		'''
+		Load the static contents of the scene from its description in
+		resources/scenes, compiled into a single .bam file for the game's
+		quality. Returns the spawns as a list of (type, position, options).
+		'''
+		compiledPath = self.app.sceneCompiler.resolve('resources/scenes/{}.json'.format(name), self.app.quality, self.lodDistances)
+		# Read the whole scene in one go, sharing its geometry with any other copy of the scene
+		root = self.app.assetCache.getModel(compiledPath)
+		root.reparentTo(self.renderTree)
+
+		for model in root.findAllMatches('**/=key'):
+			self.models[model.getTag('key')] = model
+			# Load the model's textures small, and let them grow as they are needed
+			if self.app.textureStreamer is not None:
+				self.defer(self.app.textureStreamer.register, model)
+		# Draw each chunk of instances in one call, from the shared vertices
+		for chunk in root.findAllMatches('**/=instances'):
+			if self.app.quality == 'super-low':
+				applyInstancing(chunk)
+			else:
+				self.defer(applyInstancing, chunk, self.app.render_pipeline)
+		for collider in root.findAllMatches('**/=collider'):
+			if self.app.debug:
+				collider.show()
+		for light in root.findAllMatches('**/=light'):
+			self.renderTree.setLight(light)
+
+		if root.hasTag('fog'):
+			settings = json.loads(root.getTag('fog'))
+			fog = Fog(name+'_fog')
+			fog.setColor(*settings['color'])
+			fog.setExpDensity(settings['density'])
+			self.renderTree.setFog(fog)
+		if root.hasTag('background'):
+			self.backgroundColor = json.loads(root.getTag('background'))['color']
+
+		# If the game is running under the RenderPipeline, initialise the scene
+		if self.app.quality != 'super-low':
+			self.defer(self.app.render_pipeline.prepare_scene, root)
+
+		return [(spawn.getTag('spawn'), spawn.getPos(self.renderTree), json.loads(spawn.getTag('options'))) for spawn in root.findAllMatches('**/=spawn')]
+
 	def addColliderNode(self, parent=None):
 		'''
 		Add an empty colliderNode to the render tree
@@ -101,13 +189,70 @@ class Scene:
 		'''
 		Load the model into the engine and return it.
 		'''
+		# Serve cached binary copies of any text egg files
+		modelName = self.app.bamCache.resolve(modelName)
 		# Check if the model is an Actor or static model
 		if isActor:
+			# Resolve the animation files through the cache as well
+			anims = {name: self.app.bamCache.resolve(path) for name, path in anims.items()}
 			# Add the model as an Actor with the required animations
-			return Actor(modelName, anims)
+			return self.app.assetCache.getActor(modelName, anims)
 		else:
 			# Add the model as a static model
-			return self.loader.loadModel(modelName)
+			return self.app.assetCache.getModel(modelName)
+
+	def addInterpolatedNode(self, nodePath):
+		'''
+		Draw a simulated node between its last two simulated positions, so it
+		moves smoothly whatever the frame rate
+		'''
+		pos = nodePath.getPos()
+		self.interpolated.append([nodePath, pos, pos])
+
+	def simulate(self, dt):
+		'''
+		A event hook method for running the fixed rate gameplay, such as
+		AI and physics, dt seconds at a time
+		'''
+		pass
+
+	def updateServices(self, task):
+		'''
+		Update the systems shared by every scene, before the scene's own events
+		'''
+		self.app.profiler.begin('SceneTasks:Services:Animation')
+		self.animationLOD.update(task.time)
+		self.app.profiler.end('SceneTasks:Services:Animation')
+		if self.occlusion is not None:
+			self.app.profiler.begin('SceneTasks:Services:Occlusion')
+			self.occlusion.update()
+			self.app.profiler.end('SceneTasks:Services:Occlusion')
+		if self.streamer is not None:
+			self.app.profiler.begin('SceneTasks:Services:Streaming')
+			self.streamer.update()
+			self.app.profiler.end('SceneTasks:Services:Streaming')
+		if self.audio is not None:
+			self.app.profiler.begin('SceneTasks:Services:Audio')
+			self.audio.update()
+			self.app.profiler.end('SceneTasks:Services:Audio')
+
+	def addStreamedWorld(self, cellDir, prefix, cellSize=50, loadRadius=1, unloadRadius=2):
+		'''
+		Stream a map which has been split into cells by streaming.py, loading
+		the cells around the camera as it moves
+		'''
+		# Import the streamer only when a scene streams its map
+		from streaming import WorldStreamer
+		self.streamer = WorldStreamer(self.app, self.renderTree, self.app.camera, cellDir, prefix, cellSize, loadRadius, unloadRadius)
+		return self.streamer
+
+	def getLODStats(self, key):
+		'''
+		Get the triangle count of each tier of an LOD model, and the number
+		of triangles it saves compared to the most detailed tier
+		'''
+		levels = [(level.getTag('tier'), countTriangles(level)) for level in self.models[key].getChildren()]
+		return [(tier, triangles, levels[0][1] - triangles) for tier, triangles in levels]
 
 	def initScene(self):
 		'''
@@ -121,6 +266,85 @@ class Scene:
 		'''
 		pass
 
+	def eventRun(self, task):
+		'''
+		A event hook method for running the scene's events every frame
+		'''
+		return Task.cont
+
+	def addTask(self, func, name, **kwargs):
+		'''
+		Start a task which is removed when the scene is released
+		'''
+		task = self.app.taskMgr.add(func, name, **kwargs)
+		self.tasks.append(task)
+		return task
+
+	def addCleanup(self, func, *args):
+		'''
+		Call a function when the scene is released, in reverse order of adding
+		'''
+		self.cleanups.append((func, args))
+
+	def defer(self, func, *args):
+		'''
+		Call a function on the main thread once the scene is loaded, in order of adding
+		'''
+		self.deferred.append((func, args))
+
+	def runDeferred(self):
+		'''
+		Run the deferred functions. Run by the SceneManager as the scene is loaded.
+		'''
+		for func, args in self.deferred:
+			func(*args)
+		self.deferred = []
+
+	def applyBackgroundColor(self):
+		'''
+		Set the scene's background colour, restoring the old one when the
+		scene is released. Run by the SceneManager as the scene is swapped in.
+		'''
+		if self.backgroundColor is not None:
+			self.addCleanup(base.setBackgroundColor, base.getBackgroundColor())
+			base.setBackgroundColor(*self.backgroundColor)
+
+	def addCollider(self, nodePath, handler, fromMask, intoMask):
+		'''
+		Add a moving collider to the traverser until the scene is released
+		'''
+		self.app.collisionWorld.addCollider(nodePath, handler, fromMask, intoMask)
+		self.addCleanup(self.app.collisionWorld.removeCollider, nodePath)
+
+	def release(self):
+		'''
+		Free everything the scene owns. Run by the SceneManager after
+		exitScene, so a scene can't be used again once it is released.
+		'''
+		for task in self.tasks:
+			self.app.taskMgr.remove(task)
+		self.tasks = []
+		for func, args in reversed(self.cleanups):
+			func(*args)
+		self.cleanups = []
+
+		# Release the shared systems the scene set up
+		if self.streamer is not None:
+			self.streamer.unloadAll()
+		if self.audio is not None:
+			self.audio.destroy()
+		for actor in list(self.animationLOD.actors):
+			self.animationLOD.unregister(actor)
+			actor.cleanup()
+		# Take the tree out of render first, so nothing can still draw or stream it
+		self.renderTree.detachNode()
+		if self.app.textureStreamer is not None:
+			self.app.textureStreamer.releaseScene(self.renderTree)
+
+		self.interpolated = []
+		self.models = {}
+		self.renderTree.removeNode()
+
 class IntroClipScene(Scene):
 	'''
 	A subclass of the Scene class to handle the intro clip
@@ -130,11 +354,7 @@ class IntroClipScene(Scene):
 		'''
 		Initialise and run any events BEFORE loading the scene
 		'''
-		self.app = app
-		self.isPlayerControlled = False
-		self.models = {}
-		self.loader = app.loader
-		self.renderTree = deepcopy(app.emptyRenderTree)
+		Scene.__init__(self, app, False)
 
 
 		# Add the play button
@@ -168,74 +388,219 @@ class IntroClipScene(Scene):
 		return Task.cont
 
 
+class MenuScene(Scene):
+	'''
+	A subclass of the Scene class to handle the main menu, drawn with
+	Panda3D's GUI while the intro scene is built in the background
+	'''
+	# The menu music, loaded once and reused on every visit to the menu
+	music = None
+	# The entries on each page of the menu, from top to bottom
+	pages = {
+		'main': ('play', 'options', 'exit'),
+		'options': ('audio', 'resolution', 'quality', 'back'),
+		}
+
+	def __init__(self, app):
+		'''
+		Initialise and run any events BEFORE loading the scene
+		'''
+		Scene.__init__(self, app, False)
+
+		if MenuScene.music is None:
+			MenuScene.music = self.loader.loadMusic('resources/generic/sounds/menu_music.mp3')
+			MenuScene.music.setLoop(True)
+
+		# Stretch the background over the whole window
+		self.background = OnscreenImage('resources/generic/chicken.jpg', parent=app.render2d)
+		self.gui = app.aspect2d.attachNewNode('menu')
+		# Mark the selected entry with a red bar behind its text
+		self.highlight = DirectFrame(parent=self.gui, frameColor=(1, 0, 0, 1), frameSize=(-0.45, 0.45, -0.05, 0.1))
+
+		# Create the text of every entry once, only changing it when its option changes
+		self.pageNodes = {}
+		self.entries = {}
+		self.entryHeights = {}
+		for page, names in self.pages.items():
+			self.pageNodes[page] = self.gui.attachNewNode('menu-'+page)
+			for i, name in enumerate(names):
+				self.entryHeights[name] = 0.4 - i * 0.3
+				self.entries[name] = OnscreenText(text=self.getLabel(name), parent=self.pageNodes[page],
+					pos=(0, self.entryHeights[name]), scale=0.08, fg=(1, 1, 1, 1), shadow=(0, 0, 0, 1))
+
+		# Set when Play is chosen, until the intro has finished loading
+		self.starting = False
+		self.showPage('main')
+
+	def getLabel(self, name):
+		'''
+		Get the text of a menu entry
+		'''
+		options = self.app.options
+		if name == 'audio':
+			return 'Sound: ' + options['audio'].upper()
+		if name == 'resolution':
+			return 'Resolution: ' + options['resolution']
+		if name == 'quality':
+			label = 'Quality: ' + options['quality'].title()
+			# The renderer is chosen at startup, so a new quality needs a restart
+			if options['quality'] != self.app.quality:
+				label += ' (on restart)'
+			return label
+		return name.title()
+
+	def showPage(self, page):
+		'''
+		Show a page of the menu, selecting its first entry
+		'''
+		for name, pageNode in self.pageNodes.items():
+			if name == page:
+				pageNode.show()
+			else:
+				pageNode.hide()
+		self.page = page
+		self.selection = 0
+		self.moveSelection(0)
+
+	def moveSelection(self, step):
+		'''
+		Move the selection up or down the current page
+		'''
+		names = self.pages[self.page]
+		self.selection = min(max(self.selection + step, 0), len(names) - 1)
+		self.highlight.setZ(self.entryHeights[names[self.selection]])
+
+	def select(self):
+		'''
+		Run the selected menu entry
+		'''
+		name = self.pages[self.page][self.selection]
+		if name == 'play':
+			self.starting = True
+		elif name == 'options':
+			self.showPage('options')
+		elif name == 'back':
+			self.showPage('main')
+		elif name == 'exit':
+			self.app.userExit()
+		else:
+			options = self.app.options
+			if name == 'audio':
+				self.app.loadSettings({'audio': 'off' if options['audio'] == 'on' else 'on'})
+			elif name == 'resolution':
+				self.app.loadSettings({'resolution': '1080p' if options['resolution'] == '720p' else '720p'})
+			elif name == 'quality':
+				quality = options['quality']
+				options['quality'] = 'super-low' if quality == 'low' else ('low' if quality == 'high' else 'high')
+			self.entries[name].setText(self.getLabel(name))
+			self.app.saveSettings()
+
+	def initScene(self):
+		'''
+		Run events upon starting the scene
+		'''
+		self.music.play()
+		# Build the intro while the menu is shown, so Play can switch straight to it
+		self.app.sceneMgr.preloadScene(IntroScene)
+
+		# Navigate with the arrow keys or w and s
+		for action, callback in self.getInputCallbacks():
+			self.app.input.onPress(action, callback)
+
+	def getInputCallbacks(self):
+		'''
+		Get the actions the menu responds to, with their callbacks
+		'''
+		return [('menu-up', self.moveUp), ('forward', self.moveUp),
+			('menu-down', self.moveDown), ('backward', self.moveDown),
+			('menu-select', self.select)]
+
+	def moveUp(self):
+		'''
+		Select the entry above the current one
+		'''
+		self.moveSelection(-1)
+
+	def moveDown(self):
+		'''
+		Select the entry below the current one
+		'''
+		self.moveSelection(1)
+
+	def exitScene(self):
+		'''
+		Run events upon exiting the scene
+		'''
+		self.music.stop()
+		for action, callback in self.getInputCallbacks():
+			self.app.input.removeCallback(action, callback)
+		# The GUI isn't part of the render tree, so remove it separately
+		self.highlight.destroy()
+		self.background.destroy()
+		self.gui.removeNode()
+
+	def eventRun(self, task):
+		'''
+		Run constantly updating events
+		'''
+		if self.starting:
+			# Switch to the intro as soon as it has finished loading
+			if self.app.sceneMgr.switchToPreloaded(IntroScene):
+				return Task.cont
+			label = 'Loading {}%'.format(int(self.app.sceneMgr.getLoadProgress() * 100))
+			if self.entries['play'].getText() != label:
+				self.entries['play'].setText(label)
+		return Task.cont
+
+
 class IntroScene(Scene):
 	'''
 	A subclass of the Scene class to handle the main menu
 	and all of it's required tasks + events
 	'''
+	loadEstimate = 5
+
 	def __init__(self, app):
 		'''
 		Initialise and run any events BEFORE loading the scene
 		'''
-		self.app = app
-		self.isPlayerControlled = False
-		self.models = {}
-		self.loader = app.loader
-		self.renderTree = deepcopy(app.emptyRenderTree)
-
-		# Add the ground model
-		self.addObject("ground.bam", scale=(3.6,3.6,2), key="ground")
-
-		# Add the barn
-		barnModel = self.addObject("barn.bam", scale=(1, 1, 1))
-
-		# Create a corn model and add it in the bottom corner
-		self.addObject("corn.egg", pos=(-62, -62, 0), scale=(1, 1, 1.3), key="corn")
-
-		# Iterate a 25x25 square for the corn
-		for x in range(25):
-			for z in range(25):
-				# Use basic maths to create a 'lollypop' shape cutout
-				if (x-12)**2+(z-12)**2 > 25 and (abs(x-12) > 1 or z > 12):
-					# Add a corn instance to the scene
-					self.addObject("corn.egg", (x*5, z*5, 0), instanceTo="corn")
-
-		# Add the AI World
-		self.AIworld = AIWorld(self.renderTree)
-
-		# Add generic linear fog on super-low quality mode
-		if app.quality == 'super-low':
-			fog = Fog("corn_fog")
-			# Set the fog colour
-			fog.setColor(0.8,0.8, 0.8)
-			# Set the density of the fog
-			fog.setExpDensity(0.005)
-			# Add the fog to the scene
-			self.renderTree.setFog(fog)
-			# Set the scene's background colour
-			base.setBackgroundColor(0.635, 0.454, 0.494)
-			# Create an empty ambient light
-			alight = AmbientLight('alight')
-			# Set the colour
-			alight.setColor(VBase4(0.2, 0.2, 0.2, 0.2))
-			# Attach the node to the render tree
-			alnp = render.attachNewNode(alight)
-			# Set the light to illuminate the scene
-			render.setLight(alnp)
-
-		# Add the two chickens and set the maximum velocity (force) on them
-		self.chickenOne = Chicken(self, (20, -50, 0))
-		self.chickenOne.aiChar.setMaxForce(70)
-		self.chickenTwo = Chicken(self, (-20, -40, 0))
-		self.chickenTwo.aiChar.setMaxForce(70)
-
-		# Add them to the AI World
-		self.AIworld.addAiChar(self.chickenOne.aiChar)
-		self.AIworld.addAiChar(self.chickenTwo.aiChar)
-
-		# Enable the pursue behaviour
-		self.chickenOne.aiBehaviour.pursue(self.app.camera)
-		self.chickenTwo.aiBehaviour.pursue(self.app.camera)
+		Scene.__init__(self, app, False)
+
+		# The scene loaded once the motion path ends, or None to stay in the intro
+		self.nextScene = SceneOne
+
+		# Load the ground, barn, cornfield and super-low lighting from the scene description
+		spawns = self.loadDescription('intro')
+
+		# Add the AI World, with only the entities near the camera kept awake
+		self.aiWorld = AIWorld(self.renderTree)
+		self.activator = AIActivator(self.aiWorld, self.app.camera)
+
+		# Import the audio and crowd, which pulls in NumPy, only when the intro needs them
+		from audio import AudioService
+		from crowd import ChickenCrowd
+
+		# Share one pool of voices between every chicken's sounds
+		self.audio = AudioService(self.app, self.app.camera)
+
+		# Add them to the crowd which reacts to the player's distance
+		self.crowd = ChickenCrowd(self.app.camera)
+
+		# Add a chicken at each spawn and set the maximum velocity (force) on it
+		self.chickens = []
+		for kind, pos, options in spawns:
+			if kind != 'chicken':
+				continue
+			chicken = Chicken(self, pos)
+			chicken.aiChar.setMaxForce(options.get('maxForce', 70))
+			# Add it to the AI World and the crowd, taking it out of both on release
+			self.activator.register(chicken)
+			self.crowd.add(chicken)
+			self.addCleanup(self.activator.unregister, chicken)
+			self.addCleanup(self.crowd.remove, chicken)
+			# Enable the pursue behaviour
+			chicken.aiBehaviour.pursue(self.app.camera)
+			self.chickens.append(chicken)
 
 	def eventRun(self, task):
 		'''
@@ -243,14 +608,25 @@ class IntroScene(Scene):
 		'''
 		# If the movement controller has finished its path then
 		if self.app.controller and self.app.controller.clock_obj.get_frame_time() > self.app.controller.curve_time_end:
-			# delete the motion controller
-			self.app.controller = None
-			# Load the first scene of the gameplay
-			self.app.sceneMgr.loadScene(SceneOne(self.app))
-		# Update the AI world
-		self.AIworld.update()
+			# Load the first scene of the gameplay once it has finished loading
+			if self.nextScene is not None and self.app.sceneMgr.switchToPreloaded(self.nextScene):
+				# delete the motion controller
+				self.app.controller = None
 		return Task.cont
 
+	def simulate(self, dt):
+		'''
+		Run the fixed rate gameplay for the scene
+		'''
+		# Update the chickens' reactions to the player, then the awake AI
+		self.app.profiler.begin('SceneTasks:Simulation:Entities')
+		self.crowd.update(dt)
+		self.app.profiler.end('SceneTasks:Simulation:Entities')
+		self.app.profiler.begin('SceneTasks:Simulation:AI')
+		self.activator.update()
+		self.aiWorld.update()
+		self.app.profiler.end('SceneTasks:Simulation:AI')
+
 	def initScene(self):
 		'''
 		Set up the movement controller and begin the motion path.
@@ -271,16 +647,21 @@ class IntroScene(Scene):
 			(Vec3(5, -4, 4), Vec3(-190, 0, -5)),
 			(Vec3(4, 0, 0.5), Vec3(-190, 80, 0))
 			)
-		# Create the controller for movement
+		# Create the controller for movement, importing it only when the intro needs it
+		from rpcore.util.movement_controller import MovementController
 		self.app.controller = MovementController(self.app)
 		# Set the initial position
 		self.app.controller.set_initial_position(Vec3(0, -63, 4), Vec3(0, 0, 0))
+		# Own every task the controller starts, so they stop if the intro is left early
+		tasksBefore = set(self.app.taskMgr.getAllTasks())
 		# Run the setup on the movement controller
 		self.app.controller.update_task = self.app.addTask(nullTask, 'meh')
 		# Play the pre-defined motion path
 		self.app.controller.play_motion_path(motionPath, 0.8)
 		# Remove the player movement controls
 		self.app.taskMgr.remove(self.app.controller.update_task)
+		self.tasks.extend(set(self.app.taskMgr.getAllTasks()) - tasksBefore)
+		self.addCleanup(setattr, self.app, 'controller', None)
 
 		# Unhide the 2d overlay.
 		self.app.aspect2d.show()
@@ -289,9 +670,14 @@ class IntroScene(Scene):
 		# set up the black image
 		self.fadeQuad = OnscreenImage(image='resources/generic/fade.png',pos=(-0.5, 0, 0), scale=(2, 1, 1))
 		self.fadeQuad.setTransparency(TransparencyAttrib.MAlpha)
+		self.addCleanup(self.removeFade)
 
 		# Add the fadein transition
-		self.app.taskMgr.add(self.fadeIn, 'fade-task')
+		self.addTask(self.fadeIn, 'fade-task')
+
+		# Start loading the first gameplay scene while the motion path plays
+		if self.nextScene is not None:
+			self.app.sceneMgr.preloadScene(self.nextScene)
 
 	def fadeIn(self, task):
 		'''
@@ -299,7 +685,7 @@ class IntroScene(Scene):
 		'''
 		# If more than 4 seconds have passed then finish the task
 		if task.time > 4:
-			self.fadeQuad.destroy()
+			self.removeFade()
 			return
 		# Get the alpha of the square
 		alpha = task.time / 4
@@ -307,63 +693,69 @@ class IntroScene(Scene):
 		self.fadeQuad.setAlphaScale(1-alpha)
 		return Task.cont
 
+	def removeFade(self):
+		'''
+		Remove the black rectangle, if it hasn't been already
+		'''
+		if not self.fadeQuad.isEmpty():
+			self.fadeQuad.destroy()
+
 class SceneOne(Scene):
+	loadEstimate = 3
+
 	def __init__(self, app):
 		'''
 		Initialise and run any events BEFORE loading the scene
 		'''
-		self.app = app
-		self.isPlayerControlled = True
-		self.models = {}
-		self.loader = app.loader
-		self.renderTree = deepcopy(app.emptyRenderTree)
+		Scene.__init__(self, app, True)
 
-		# Add the AIWorld
+		# Add the AIWorld, with only the entities near the camera kept awake
 		self.aiWorld = AIWorld(self.renderTree)
-
-		# Add the map to the scene
-		self.addObject('roof.bam', pos=(15, 10, -4), scale=(3.6, 3.6, 3.6), key='roof', isGeneric=self.app.quality != 'super-low')
-		self.addObject("scene1.bam", pos=(15, 10, -4), scale=(3.6,3.6,3.6), key="ground", isGeneric=self.app.quality != 'super-low')
-		self.addObject('floor.bam', pos=(15, 10, -4), scale=(3.6, 3.6, 3.6), key='floor', isGeneric=self.app.quality != 'super-low')
-
-		# Add the map collider to the scene
-		# self.mapCollider = self.renderTree.attachNewNode(CollisionNode('mapCollider'))
-		self.mapColl = self.app.loader.loadModel('resources/generic/map_coll.egg')
-		self.mapColl.reparentTo(self.renderTree)
-		# Set the position and scale
-		self.mapColl.setPos(15, 10, -4)
-		self.mapColl.setScale(3.6, 3.6, 3.6)
-		self.mapColl.show()
-		# self.mapCollider.show()
-
-		# Add the player to the scene
+		self.activator = AIActivator(self.aiWorld, self.app.camera)
+
+		# Load the map and its collider from the scene description
+		self.loadDescription('scene_one')
+
+		# Split the map into rooms and cull them through their portals, if the rooms have been authored
+		if os.path.exists('resources/generic/scene1_cells.json'):
+			from occlusion import PortalCuller
+			self.occlusion = PortalCuller('resources/generic/scene1_cells.json', self.renderTree, self.app.cam)
+			for key in ('roof', 'ground', 'floor'):
+				self.occlusion.addModel(self.models.pop(key))
+			# The models' Geoms now live in the room nodes, so stream the textures for those
+			if self.app.textureStreamer is not None:
+				for room in list(self.occlusion.rooms.values()) + [self.occlusion.shared]:
+					self.defer(self.app.textureStreamer.register, room)
+
+		# Create the player, which is added to the scene once it is shown
 		self.player = Player(self.app)
-		self.player.addToScene()
-
-		# Generate a list of light positions for the map
-		light_pos = [(15.45, 0.5, 6), (54.62, -227.6, 6), (86.83, -227.38, 6)]
-		# Iterate and place a light at that position
-		for light in light_pos:
-			pass
-
 
 	def eventRun(self, task):
 		'''
 		Run any constant events for the scene
 		'''
-		# Update the ai tasks
+		return Task.cont
+
+	def simulate(self, dt):
+		'''
+		Run the fixed rate gameplay for the scene
+		'''
+		# Update the ai tasks of the entities near the player
+		self.app.profiler.begin('SceneTasks:Simulation:AI')
+		self.activator.update()
 		self.aiWorld.update()
+		self.app.profiler.end('SceneTasks:Simulation:AI')
 		# Update the physics of the world.
-		# self.bulletWorld.doPhysics(task.time - self.app.sceneMgr.last)
-		return Task.cont
+		# self.bulletWorld.doPhysics(dt)
 
 	def initScene(self):
 		'''
 		Run any events AFTER loading the scene
 		'''
+		# Add the player to the scene
+		self.player.addToScene(self)
 		# Set the gravity on the physics world
 		# self.bulletWorld.setGravity(Vec3(0, 0,-0.2))
-		pass
 
 
 def nullTask(task):
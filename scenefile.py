@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+'''
+
+Scene descriptions for PoultryGeist
+
+A scene description is a JSON file in resources/scenes listing the static
+contents of a scene, in the scene's coordinates:
+
+{"models": [{"name": "barn.bam", "key": "barn", "pos": [x, y, z], "hpr": [h, p, r],
+             "scale": [x, y, z], "generic": false, "lod": false,
+             "instances": [[x, y, z], ...], "chunkSize": 25}, ...],
+ "colliders": [{"path": "resources/generic/map_coll.egg", "pos": [x, y, z], "scale": [x, y, z]}, ...],
+ "lights": [{"type": "ambient", "color": [r, g, b, a]},
+            {"type": "directional", "color": [r, g, b, a], "hpr": [h, p, r]},
+            {"type": "point", "color": [r, g, b, a], "pos": [x, y, z]}, ...],
+ "spawns": [{"type": "chicken", "pos": [x, y, z], ...}, ...],
+ "fog": {"color": [r, g, b], "density": 0.005},
+ "background": {"color": [r, g, b]}}
+
+Every entry can also list the "qualities" it is used at. Models with
+instances are grouped into chunks, each drawn with hardware instancing
+from one shared copy of the model's vertices. The compile
+step bakes everything for one quality into a single .bam file, which the
+Scene class loads in one read. Precompile with:
+	python scenefile.py <description> [--quality low]
+
+'''
+# Import the C++ Panda3D modules
+from panda3d.core import AmbientLight, DirectionalLight, PointLight, LODNode
+from panda3d.core import BoundingBox, Filename, GeomEnums, Loader, LoaderOptions, ModelRoot
+from panda3d.core import NodePath, Shader, Texture, TransformState, Vec3
+
+from assets import BamCache, writeBamFile
+from collision import CollisionWorld, compileCollider
+
+from array import array
+import argparse
+import hashlib
+import json
+import os
+
+# The quality tiers used for distance LOD, from the most to least detailed
+LOD_TIERS = ('high', 'low', 'super-low')
+# The distances at which the camera switches between the LOD tiers
+LOD_DISTANCES = (0, 40, 100, 1000)
+
+# The version of the compiled file layout, part of the cache key so older files are rebuilt
+COMPILED_VERSION = 3
+
+# The shaders which draw instanced chunks, under the RenderPipeline and without it
+INSTANCING_EFFECT = 'resources/shaders/instancing.yaml'
+INSTANCING_SHADERS = ('resources/shaders/instancing.vert', 'resources/shaders/instancing.frag')
+
+# The Panda3D node made for each type of light
+LIGHT_TYPES = {'ambient': AmbientLight, 'directional': DirectionalLight, 'point': PointLight}
+
+def batchInstances(template, positions, chunkSize, name):
+	'''
+	Place a model at many positions, grouped into square chunks of chunkSize
+	units. Each chunk is one reference to the template's Geoms, tagged with
+	the offsets of its instances, which applyInstancing draws in a single
+	instanced draw call. Every chunk shares the same vertex data, and is
+	culled as a single node, so distant or hidden chunks are skipped.
+	'''
+	# Bake the template's transform into one copy of its vertices and merge its Geoms
+	template = template.copyTo(NodePath('template'))
+	template.flattenStrong()
+
+	# Sort every position into the chunk that contains it
+	chunks = {}
+	for position in positions:
+		cell = (int(position[0] // chunkSize), int(position[1] // chunkSize))
+		chunks.setdefault(cell, []).append(position)
+
+	# Create a root node to hold all of the chunks
+	batchRoot = NodePath("batch-"+name)
+	for cell, cellPositions in chunks.items():
+		# Copy the template's nodes once per chunk, sharing its Geoms
+		chunk = template.copyTo(batchRoot)
+		chunk.setName("chunk-{}-{}".format(*cell))
+		chunk.setTag('instances', json.dumps([list(position) for position in cellPositions]))
+	return batchRoot
+
+def applyInstancing(chunk, renderPipeline=None):
+	'''
+	Draw a chunk made by batchInstances once for each of its instances,
+	reading the offsets from a buffer texture. Shader inputs aren't kept in
+	.bam files, so this is run on every chunk after the scene is loaded.
+	'''
+	offsets = json.loads(chunk.getTag('instances'))
+	data = array('f')
+	for offset in offsets:
+		data.extend((offset[0], offset[1], offset[2], 0))
+	buffer = Texture('instance-offsets')
+	buffer.setupBufferTexture(len(offsets), Texture.TFloat, Texture.FRgba32, GeomEnums.UHStatic)
+	buffer.setRamImage(data.tobytes())
+	chunk.setShaderInput('InstanceOffsets', buffer)
+	chunk.setInstanceCount(len(offsets))
+
+	# The template's bounds only cover the first instance, so cover every offset
+	low, high = chunk.getTightBounds(chunk)
+	xs, ys, zs = zip(*offsets)
+	chunk.node().setBounds(BoundingBox(low + Vec3(min(xs), min(ys), min(zs)), high + Vec3(max(xs), max(ys), max(zs))))
+	chunk.node().setFinal(True)
+
+	if renderPipeline is not None:
+		renderPipeline.set_effect(chunk, INSTANCING_EFFECT, {})
+	else:
+		chunk.setShader(Shader.load(Shader.SL_GLSL, *INSTANCING_SHADERS))
+
+class SceneCompiler:
+	'''
+	Compiles scene descriptions into a single .bam file for each quality,
+	kept in a cache and rebuilt when the description or any of the files
+	it uses change. Spawns, lights and model keys are stored as tags on
+	the nodes, and the fog and background on the root.
+	'''
+	def __init__(self, bamCache, cacheDir='cache/scenes'):
+		self.bamCache = bamCache
+		self.cacheDir = cacheDir
+		os.makedirs(self.cacheDir, exist_ok=True)
+
+	def isUsed(self, entry, quality):
+		'''
+		Check if a description entry is used at a quality
+		'''
+		return quality in entry.get('qualities', LOD_TIERS)
+
+	def getModelPaths(self, model, quality):
+		'''
+		Get the files a model entry is loaded from, most detailed first
+		'''
+		if model.get('lod'):
+			# Only use the tiers at or below the chosen quality
+			tiers = LOD_TIERS[LOD_TIERS.index(quality):]
+			return [path for path in ('resources/{}/{}'.format(tier, model['name']) for tier in tiers) if os.path.exists(path)]
+		return ['resources/{}/{}'.format('generic' if model.get('generic') else quality, model['name'])]
+
+	def getSources(self, description, quality):
+		'''
+		Get every file a description reads at a quality
+		'''
+		sources = []
+		for model in description.get('models', []):
+			if self.isUsed(model, quality):
+				sources.extend(self.getModelPaths(model, quality))
+		for collider in description.get('colliders', []):
+			if self.isUsed(collider, quality):
+				sources.append(collider['path'])
+		return sources
+
+	def resolve(self, path, quality, lodDistances=LOD_DISTANCES):
+		'''
+		Get the compiled .bam file of a description, compiling it if there
+		isn't one for the current version of the description and its files.
+		The LOD models switch tiers at lodDistances.
+		'''
+		with open(path) as descriptionFile:
+			description = json.load(descriptionFile)
+		sha = hashlib.sha1('{}{}{}'.format(COMPILED_VERSION, quality, tuple(lodDistances)).encode())
+		for source in [path] + self.getSources(description, quality):
+			sha.update(self.bamCache.getDigest(source).encode())
+		compiledPath = os.path.join(self.cacheDir, '{}-{}-{}.bam'.format(self.bamCache.getPrefix(path), quality, sha.hexdigest()))
+
+		if not os.path.exists(compiledPath):
+			print("[>] PoultryGeist:\t      Compiling scene {} for {}".format(path, quality))
+			root = self.compile(description, quality, lodDistances)
+			if not writeBamFile(root, compiledPath):
+				raise IOError("Couldn't write {}".format(compiledPath))
+		return compiledPath
+
+	def loadModel(self, path):
+		'''
+		Load a model straight from disk, through the bam cache
+		'''
+		options = LoaderOptions(LoaderOptions.LFNoCache | LoaderOptions.LFReportErrors)
+		node = Loader.getGlobalPtr().loadSync(Filename.fromOsSpecific(self.bamCache.resolve(path)), options)
+		if node is None:
+			raise IOError("Couldn't load {}".format(path))
+		return NodePath(node)
+
+	def compileModel(self, model, quality, lodDistances=LOD_DISTANCES):
+		'''
+		Load the files of a model entry into a single nodepath
+		'''
+		paths = self.getModelPaths(model, quality)
+		if not model.get('lod'):
+			return self.loadModel(paths[0])
+
+		# Switch between the tiers by distance below an LOD node
+		lodNode = LODNode('lod-'+model['name'])
+		root = NodePath(lodNode)
+		near = lastNear = 0
+		for path in paths:
+			tier = path.split('/')[1]
+			far = lodDistances[LOD_TIERS.index(tier)+1]
+			level = self.loadModel(path)
+			level.setTag('tier', tier)
+			level.reparentTo(root)
+			lodNode.addSwitch(far, near)
+			lastNear, near = near, far
+		# Stretch the least detailed tier out to the furthest distance
+		if lodNode.getNumSwitches():
+			lodNode.setSwitch(lodNode.getNumSwitches()-1, lodDistances[-1], lastNear)
+		return root
+
+	def compile(self, description, quality, lodDistances=LOD_DISTANCES):
+		'''
+		Build the render tree of a description at a quality
+		'''
+		# Use a model root, so the loader returns the compiled file as it is, tags and all
+		root = NodePath(ModelRoot('scene'))
+		for index, model in enumerate(description.get('models', [])):
+			if not self.isUsed(model, quality):
+				continue
+			nodePath = self.compileModel(model, quality, lodDistances)
+			nodePath.setPosHprScale(*(tuple(model.get('pos', (0, 0, 0))) + tuple(model.get('hpr', (0, 0, 0))) + tuple(model.get('scale', (1, 1, 1)))))
+			if 'instances' in model:
+				# Instanced models are placed by their offset, scale and instance positions
+				nodePath = batchInstances(nodePath, model['instances'], model.get('chunkSize', 25), model['name'])
+			nodePath.setTag('key', str(model.get('key', index)))
+			nodePath.reparentTo(root)
+
+		for collider in description.get('colliders', []):
+			if not self.isUsed(collider, quality):
+				continue
+			source = self.loadModel(collider['path'])
+			transform = TransformState.makePosHprScale(tuple(collider.get('pos', (0, 0, 0))), tuple(collider.get('hpr', (0, 0, 0))), tuple(collider.get('scale', (1, 1, 1))))
+			collisionRoot = compileCollider(source, transform, CollisionWorld.cellSize, CollisionWorld.regionSize)
+			collisionRoot.setTag('collider', collider['path'])
+			collisionRoot.reparentTo(root)
+
+		for light in description.get('lights', []):
+			if not self.isUsed(light, quality):
+				continue
+			lightNode = LIGHT_TYPES[light['type']]('light-'+light['type'])
+			lightNode.setColor(tuple(light.get('color', (1, 1, 1, 1))))
+			lightNodePath = root.attachNewNode(lightNode)
+			lightNodePath.setPosHpr(*(tuple(light.get('pos', (0, 0, 0))) + tuple(light.get('hpr', (0, 0, 0)))))
+			lightNodePath.setTag('light', light['type'])
+
+		for spawn in description.get('spawns', []):
+			if not self.isUsed(spawn, quality):
+				continue
+			spawnNodePath = root.attachNewNode('spawn-'+spawn['type'])
+			spawnNodePath.setPos(*spawn['pos'])
+			spawnNodePath.setTag('spawn', spawn['type'])
+			# Keep any other settings of the spawn for the scene to read
+			spawnNodePath.setTag('options', json.dumps({name: value for name, value in spawn.items() if name not in ('type', 'pos', 'qualities')}))
+
+		for setting in ('fog', 'background'):
+			value = description.get(setting)
+			if value is not None and self.isUsed(value, quality):
+				root.setTag(setting, json.dumps(value))
+		return root
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compile a scene description into a .bam file')
+	parser.add_argument('description')
+	parser.add_argument('--quality', nargs='+', default=list(LOD_TIERS))
+	args = parser.parse_args()
+
+	compiler = SceneCompiler(BamCache())
+	for quality in args.quality:
+		print("[>] PoultryGeist:\t      Wrote {}".format(compiler.resolve(args.description, quality)))
@@ -0,0 +1,138 @@
+'''
+
+Spatial indexing and AI activation for PoultryGeist
+
+'''
+import math
+
+class SpatialGrid:
+	'''
+	A uniform grid over the ground plane of a scene, used to find the
+	entities near a point without checking every entity.
+	'''
+	def __init__(self, cellSize=20):
+		self.cellSize = cellSize
+		# Map each grid cell to the set of entities inside it
+		self.cells = {}
+		# Map each entity to its cell and last known position
+		self.locations = {}
+
+	def getCell(self, pos):
+		'''
+		Get the grid cell containing a position
+		'''
+		return (int(pos[0] // self.cellSize), int(pos[1] // self.cellSize))
+
+	def insert(self, entity, pos):
+		'''
+		Add an entity to the grid at a position
+		'''
+		cell = self.getCell(pos)
+		self.cells.setdefault(cell, set()).add(entity)
+		self.locations[entity] = (cell, (pos[0], pos[1], pos[2]))
+
+	def remove(self, entity):
+		'''
+		Remove an entity from the grid
+		'''
+		cell, pos = self.locations.pop(entity)
+		self.cells[cell].discard(entity)
+		# Drop empty cells so the grid doesn't grow forever
+		if not self.cells[cell]:
+			del self.cells[cell]
+
+	def move(self, entity, pos):
+		'''
+		Update the position of an entity, moving it between cells if needed
+		'''
+		cell = self.getCell(pos)
+		if cell != self.locations[entity][0]:
+			self.remove(entity)
+			self.insert(entity, pos)
+		else:
+			self.locations[entity] = (cell, (pos[0], pos[1], pos[2]))
+
+	def getDistance(self, entity, pos):
+		'''
+		Get the distance between an entity's last known position and a point
+		'''
+		entityPos = self.locations[entity][1]
+		return math.sqrt(sum((entityPos[i] - pos[i])**2 for i in range(3)))
+
+	def query(self, pos, radius):
+		'''
+		Get every entity within a radius of a position
+		'''
+		minX, minY = self.getCell((pos[0] - radius, pos[1] - radius))
+		maxX, maxY = self.getCell((pos[0] + radius, pos[1] + radius))
+		found = []
+		# Only check the cells which overlap the search radius
+		for x in range(minX, maxX+1):
+			for y in range(minY, maxY+1):
+				for entity in self.cells.get((x, y), ()):
+					if self.getDistance(entity, pos) <= radius:
+						found.append(entity)
+		return found
+
+class AIActivator:
+	'''
+	Keeps only the entities near the target in the live AIWorld. Entities
+	further away sleep with their behaviours frozen and are woken when the
+	target comes near, so the AI cost depends on the local entity count.
+	Entities need an aiChar, an aiName and a modelNodePath.
+	'''
+	def __init__(self, aiWorld, target, wakeRadius=40, sleepRadius=50, cellSize=20):
+		self.aiWorld = aiWorld
+		# The nodepath entities wake around, usually the camera
+		self.target = target
+		# Sleep further out than entities wake, so they don't flicker at the edge
+		self.wakeRadius = wakeRadius
+		self.sleepRadius = sleepRadius
+		self.grid = SpatialGrid(cellSize)
+		self.awake = set()
+
+	def register(self, entity):
+		'''
+		Add an entity to the index. It starts asleep until the next update.
+		'''
+		# The scene may not be attached to render yet, so use the scene's root
+		self.grid.insert(entity, entity.modelNodePath.getPos(entity.modelNodePath.getTop()))
+
+	def unregister(self, entity):
+		'''
+		Remove an entity from the index and the AI world
+		'''
+		if entity in self.awake:
+			self.sleep(entity)
+		self.grid.remove(entity)
+
+	def wake(self, entity):
+		'''
+		Add an entity to the live AI world
+		'''
+		self.aiWorld.addAiChar(entity.aiChar)
+		self.awake.add(entity)
+
+	def sleep(self, entity):
+		'''
+		Remove an entity from the live AI world, freezing its behaviour
+		'''
+		self.aiWorld.removeAiChar(entity.aiName)
+		self.awake.discard(entity)
+
+	def update(self):
+		'''
+		Wake the entities near the target and put the distant ones to sleep
+		'''
+		root = self.target.getTop()
+		center = self.target.getPos(root)
+		# Only awake entities move, so only their positions need updating
+		for entity in self.awake:
+			self.grid.move(entity, entity.modelNodePath.getPos(root))
+
+		for entity in self.grid.query(center, self.wakeRadius):
+			if entity not in self.awake:
+				self.wake(entity)
+		for entity in list(self.awake):
+			if self.grid.getDistance(entity, center) > self.sleepRadius:
+				self.sleep(entity)
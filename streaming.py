@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+'''
+
+World streaming for PoultryGeist
+
+Large maps are split into square cells, each stored as its own .bam file
+named <prefix>_<x>_<y>.bam. Split a map with:
+	python streaming.py <model> <output folder> [--prefix name] [--cell-size 50]
+
+'''
+# Import the C++ Panda3D modules
+from panda3d.core import BitMask32, CollisionNode, Filename, GeomNode
+from panda3d.core import Loader, LoaderOptions, NodePath, TransformState
+
+from assets import estimateSize
+from collision import MASK_MAP, iterSolids
+
+from collections import deque
+import argparse
+import os
+import re
+
+class WorldStreamer:
+	'''
+	Loads the cells of a map asynchronously as the target comes near and
+	unloads them once it has moved further away, so only the cells around
+	the target stay in memory. Load and unload events are sent through the
+	messenger as 'cell-loaded' and 'cell-unloaded', and kept in a log.
+	'''
+	def __init__(self, app, root, target, cellDir, prefix, cellSize=50, loadRadius=1, unloadRadius=2):
+		self.app = app
+		# The nodepath the cells are attached to
+		self.root = root
+		# The nodepath the cells are loaded around, usually the camera
+		self.target = target
+		self.cellDir = cellDir
+		self.prefix = prefix
+		self.cellSize = cellSize
+		# Cells are loaded within loadRadius cells of the target, and unloaded
+		# beyond unloadRadius, so moving along a cell edge doesn't thrash
+		self.loadRadius = loadRadius
+		self.unloadRadius = unloadRadius
+
+		# Find the cells which exist on disk
+		pattern = re.compile(re.escape(prefix)+r'_(-?\d+)_(-?\d+)\.bam$')
+		self.available = set()
+		for fileName in os.listdir(cellDir):
+			match = pattern.match(fileName)
+			if match:
+				self.available.add((int(match.group(1)), int(match.group(2))))
+
+		# Map each loaded cell to its (nodepath, estimated size in bytes)
+		self.resident = {}
+		self.residentBytes = 0
+		# Map each cell being loaded to its load request
+		self.loading = {}
+		# Store the recent events as (frame time, 'load' or 'unload', cell)
+		self.events = deque(maxlen=1000)
+
+	def getCellPath(self, cell):
+		'''
+		Get the path of the file holding a cell
+		'''
+		return os.path.join(self.cellDir, '{}_{}_{}.bam'.format(self.prefix, *cell))
+
+	def update(self):
+		'''
+		Request the cells near the target and unload the distant ones
+		'''
+		pos = self.target.getPos(self.root)
+		center = (int(pos[0] // self.cellSize), int(pos[1] // self.cellSize))
+
+		for x in range(center[0] - self.loadRadius, center[0] + self.loadRadius + 1):
+			for y in range(center[1] - self.loadRadius, center[1] + self.loadRadius + 1):
+				cell = (x, y)
+				if cell in self.available and cell not in self.resident and cell not in self.loading:
+					self.requestCell(cell)
+
+		for cell in list(self.resident) + list(self.loading):
+			if max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) > self.unloadRadius:
+				self.unloadCell(cell)
+
+	def requestCell(self, cell):
+		'''
+		Start loading a cell in the background
+		'''
+		self.loading[cell] = self.app.loader.loadModel(self.getCellPath(cell), callback=self.onCellLoaded, extraArgs=[cell])
+
+	def onCellLoaded(self, model, cell):
+		'''
+		Attach a cell once it has finished loading
+		'''
+		# Ignore cells which were unloaded while they were loading
+		if self.loading.pop(cell, None) is None:
+			model.removeNode()
+			return
+		model.reparentTo(self.root)
+		# If the game is running under the RenderPipeline, initialise the cell
+		if self.app.quality != 'super-low':
+			self.app.render_pipeline.prepare_scene(model)
+		# Load the cell's textures small, and let them grow as they are needed
+		if self.app.textureStreamer is not None:
+			self.app.textureStreamer.register(model)
+		size = estimateSize(model)
+		self.resident[cell] = (model, size)
+		self.residentBytes += size
+		self.events.append((globalClock.getFrameTime(), 'load', cell))
+		messenger.send('cell-loaded', [cell])
+
+	def unloadCell(self, cell):
+		'''
+		Unload a cell, or cancel its load if it hasn't finished
+		'''
+		if cell in self.loading:
+			self.app.loader.cancelRequest(self.loading.pop(cell))
+			return
+		model, size = self.resident.pop(cell)
+		if self.app.textureStreamer is not None:
+			self.app.textureStreamer.releaseScene(model)
+		model.removeNode()
+		self.app.loader.unloadModel(self.getCellPath(cell))
+		self.residentBytes -= size
+		self.events.append((globalClock.getFrameTime(), 'unload', cell))
+		messenger.send('cell-unloaded', [cell])
+
+	def unloadAll(self):
+		'''
+		Unload every cell, eg. when the scene is exited
+		'''
+		for cell in list(self.resident) + list(self.loading):
+			self.unloadCell(cell)
+
+def splitMap(model, cellSize):
+	'''
+	Split the geometry and collision solids of a map into square cells,
+	baking the transforms and render states into copies. Returns a
+	dictionary mapping each cell to its nodepath.
+	'''
+	cells = {}
+
+	def getCell(center):
+		cell = (int(center[0] // cellSize), int(center[1] // cellSize))
+		if cell not in cells:
+			cells[cell] = NodePath('cell-{}-{}'.format(*cell))
+		return cells[cell]
+
+	for geomNodePath in model.findAllMatches('**/+GeomNode'):
+		geomNode = geomNodePath.node()
+		mat = geomNodePath.getMat(model)
+		state = geomNodePath.getState(model)
+		for i in range(geomNode.getNumGeoms()):
+			geom = geomNode.getGeom(i).makeCopy()
+			geom.transformVertices(mat)
+			cellNodePath = getCell(geom.getBounds().getApproxCenter())
+			cellGeoms = cellNodePath.find('geometry')
+			if cellGeoms.isEmpty():
+				cellGeoms = cellNodePath.attachNewNode(GeomNode('geometry'))
+			cellGeoms.node().addGeom(geom, state.compose(geomNode.getGeomState(i)))
+
+	# Only copy the collision solids, so visible geometry isn't made collidable
+	if model.findAllMatches('**/+CollisionNode').getNumPaths():
+		for solid in iterSolids(model, TransformState.makeIdentity()):
+			cellNodePath = getCell(solid.getCollisionOrigin())
+			collider = cellNodePath.find('collider')
+			if collider.isEmpty():
+				collider = cellNodePath.attachNewNode(CollisionNode('collider'))
+				collider.node().setFromCollideMask(BitMask32.allOff())
+				collider.node().setIntoCollideMask(MASK_MAP)
+			collider.node().addSolid(solid)
+	return cells
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Split a map model into cells for streaming')
+	parser.add_argument('model')
+	parser.add_argument('output')
+	parser.add_argument('--prefix', help='cell file prefix, defaults to the model name')
+	parser.add_argument('--cell-size', type=float, default=50)
+	args = parser.parse_args()
+
+	options = LoaderOptions(LoaderOptions.LFNoCache | LoaderOptions.LFReportErrors)
+	model = NodePath(Loader.getGlobalPtr().loadSync(Filename.fromOsSpecific(args.model), options))
+	prefix = args.prefix or os.path.splitext(os.path.basename(args.model))[0]
+	os.makedirs(args.output, exist_ok=True)
+	for cell, cellNodePath in splitMap(model, args.cell_size).items():
+		cellNodePath.writeBamFile(Filename.fromOsSpecific(os.path.join(args.output, '{}_{}_{}.bam'.format(prefix, *cell))))
+		print("[>] PoultryGeist:\t      Wrote cell {} {}".format(*cell))
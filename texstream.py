@@ -0,0 +1,213 @@
+'''
+
+Texture streaming for PoultryGeist
+
+'''
+# Import the C++ Panda3D modules
+from panda3d.core import PNMImage, TP_low
+
+from collections import deque
+import math
+
+class StreamedTexture:
+	'''
+	A texture whose image is swapped for smaller or larger copies of its
+	source file as the models using it come and go from view
+	'''
+	def __init__(self, texture, path, fullSize):
+		self.texture = texture
+		self.path = path
+		# The width and height of the source image
+		self.fullSize = fullSize
+		# The longest side of the image currently loaded, and its memory use
+		self.size = 0
+		self.bytes = 0
+		# The nodepaths of the models drawn with the texture
+		self.users = []
+		# The longest side the texture should have to suit its size on screen
+		self.need = 0
+		self.loading = False
+
+class TextureStreamer:
+	'''
+	Loads each texture of a model at a small size straight away, then
+	reloads it larger on a background thread as it grows on screen, most
+	needed first. Textures are kept within a memory budget, and shrink back
+	down once their models are distant or no longer in the scene. Only
+	image files are streamed; textures already built into .txo files by
+	build_resources.py load whole.
+	'''
+	# The longest side textures are first loaded at, and never shrink below
+	minSize = 64
+
+	def __init__(self, app, budget=128 * 2**20):
+		self.app = app
+		self.budget = budget
+		# Map each streamed Texture to its details
+		self.textures = {}
+		self.residentBytes = 0
+		# Store the (entry, image) of each finished background read
+		self.loaded = deque()
+		# The number of times a texture has been grown and shrunk
+		self.refined = 0
+		self.dropped = 0
+
+		# Read the images on their own low priority thread
+		app.taskMgr.setupTaskChain('texture-loader', numThreads=1, threadPriority=TP_low)
+		app.taskMgr.add(self.update, 'texture-streamer')
+
+	def register(self, model):
+		'''
+		Start streaming the textures of a model. New ones are given a one
+		pixel placeholder straight away, and read at the smallest size on
+		the loading thread, so no image is decoded by the caller. Must be
+		run on the main thread, as update and releaseScene are.
+		'''
+		# Skip models which were removed before a deferred registration ran
+		if model.isEmpty():
+			return
+		for texture in model.findAllTextures():
+			entry = self.textures.get(texture)
+			if entry is None:
+				path = texture.getFullpath().toOsSpecific()
+				header = PNMImage()
+				# Skip textures which aren't plain image files
+				if not path or not header.readHeader(texture.getFullpath()):
+					continue
+				entry = StreamedTexture(texture, path, (header.getXSize(), header.getYSize()))
+				self.textures[texture] = entry
+				# Give the texture an image, so Panda3D doesn't read the whole file when it is drawn
+				placeholder = PNMImage(1, 1, header.getNumChannels())
+				placeholder.fill(0.5)
+				if placeholder.hasAlpha():
+					placeholder.alphaFill(1)
+				self.applyImage(entry, placeholder)
+				self.request(entry, self.minSize)
+			entry.users.append(model)
+
+	def releaseScene(self, root):
+		'''
+		Stop streaming for the models below a root, such as a released
+		scene or an unloaded cell, forgetting the textures nothing else uses
+		'''
+		for texture, entry in list(self.textures.items()):
+			entry.users = [user for user in entry.users if not user.isEmpty() and not root.isAncestorOf(user)]
+			if not entry.users:
+				del self.textures[texture]
+				self.residentBytes -= entry.bytes
+
+	def getBytes(self, image):
+		'''
+		Estimate the memory used by an image with a full chain of mipmaps
+		'''
+		return image.getXSize() * image.getYSize() * 4 * 4 // 3
+
+	def readImage(self, entry, size):
+		'''
+		Read a texture's source file scaled down so its longest side fits size
+		'''
+		scale = min(1.0, size / max(entry.fullSize))
+		image = PNMImage()
+		# Decoders such as JPEG's can skip the detail that isn't needed
+		image.setReadSize(max(1, int(entry.fullSize[0] * scale)), max(1, int(entry.fullSize[1] * scale)))
+		image.read(entry.path)
+		return image
+
+	def applyImage(self, entry, image):
+		'''
+		Replace a texture's image, keeping its sampler settings
+		'''
+		sampler = entry.texture.getDefaultSampler()
+		entry.texture.load(image)
+		entry.texture.setDefaultSampler(sampler)
+		bytes = self.getBytes(image)
+		self.residentBytes += bytes - entry.bytes
+		entry.bytes = bytes
+		entry.size = max(image.getXSize(), image.getYSize())
+
+	def getNeed(self, entry):
+		'''
+		Get the longest side a texture needs for the largest of its models on screen
+		'''
+		lens = self.app.camLens
+		# The screen pixels covered by one unit at one unit from the camera
+		pixelsPerUnit = self.app.win.getYSize() / (2 * math.tan(math.radians(lens.getFov()[1] / 2)))
+		need = 0
+		entry.users = [user for user in entry.users if not user.isEmpty()]
+		for user in entry.users:
+			# Models outside the current scene don't need any detail
+			if user.getTop() != self.app.render or user.isHidden():
+				continue
+			bounds = user.getBounds()
+			if bounds.isEmpty():
+				continue
+			radius = bounds.getRadius() * max(user.getScale(self.app.camera))
+			distance = max(self.app.camera.getRelativePoint(user, bounds.getCenter()).length(), radius, 1)
+			need = max(need, pixelsPerUnit * 2 * radius / distance)
+		# Round up to a power of two, within the size of the source image
+		if need == 0:
+			return self.minSize
+		return min(max(self.minSize, 2 ** int(math.ceil(math.log(need, 2)))), max(entry.fullSize))
+
+	def request(self, entry, size):
+		'''
+		Reload a texture at a new size on the background thread
+		'''
+		entry.loading = True
+		self.app.taskMgr.add(self.readInBackground, 'texture-stream-read', extraArgs=[entry, size], taskChain='texture-loader')
+
+	def readInBackground(self, entry, size):
+		'''
+		Read a texture's image on the loading thread
+		'''
+		self.loaded.append((entry, self.readImage(entry, size)))
+
+	def update(self, task):
+		'''
+		Apply the finished reads, then start the next most needed one
+		'''
+		self.app.profiler.begin('TextureStreaming')
+		while self.loaded:
+			entry, image = self.loaded.popleft()
+			entry.loading = False
+			# Skip textures which were released while they were being read
+			if self.textures.get(entry.texture) is entry:
+				self.applyImage(entry, image)
+
+		# Copy the entries in one step, as scenes on the loading thread may add more
+		entries = list(self.textures.values())
+		# Only read one texture at a time, so the most needed is always next
+		if not any(entry.loading for entry in entries):
+			for entry in entries:
+				entry.need = self.getNeed(entry)
+			self.refine(entries)
+		self.app.profiler.end('TextureStreaming')
+		return task.cont
+
+	def refine(self, entries):
+		'''
+		Grow the texture furthest below its need, shrinking the textures
+		furthest above theirs to stay within the budget
+		'''
+		if not entries:
+			return
+		# Pick the textures with the largest gap between the size they have and need
+		grow = max(entries, key=lambda entry: entry.need / entry.size)
+		shrink = max(entries, key=lambda entry: entry.size / entry.need)
+
+		if self.residentBytes > self.budget or grow.need <= grow.size:
+			# Free memory from textures at least twice as large as they need to be
+			if shrink.size >= 2 * shrink.need:
+				self.dropped += 1
+				self.request(shrink, shrink.need)
+			return
+
+		# Estimate the memory the larger image will take
+		scale = grow.need / grow.size
+		extra = grow.bytes * scale * scale - grow.bytes
+		if self.residentBytes + extra <= self.budget:
+			self.refined += 1
+			self.request(grow, grow.need)
+		elif shrink.size > shrink.need:
+			self.dropped += 1
+			self.request(shrink, shrink.need)
@@ -0,0 +1,74 @@
+'''
+
+Graphics warm-up for PoultryGeist
+
+'''
+# Import the C++ Panda3D modules
+from panda3d.core import NodePath
+
+from time import perf_counter
+
+def countPrepared(gsg):
+	'''
+	Get the number of each kind of resource the GSG has uploaded
+	'''
+	prepared = gsg.getPreparedObjects()
+	return {
+		'textures': prepared.getNumPreparedTextures(),
+		'vertexBuffers': prepared.getNumPreparedVertexBuffers(),
+		'indexBuffers': prepared.getNumPreparedIndexBuffers(),
+		'geoms': prepared.getNumPreparedGeoms(),
+		'shaders': prepared.getNumPreparedShaders(),
+		}
+
+def warmUpScene(app, root, autoShader=False, size=64):
+	'''
+	Upload the textures, vertex buffers and shaders of a render tree before
+	it is first shown, so they aren't prepared mid-game as they come into
+	view. Returns the number of each resource prepared and the time taken.
+	'''
+	gsg = app.win.getGsg()
+	start = perf_counter()
+	before = countPrepared(gsg)
+
+	# Give the tree the state it will have below render, so the same shaders are made
+	stage = NodePath('warmup')
+	stage.setState(app.render.getState())
+	if autoShader:
+		stage.setShaderAuto()
+	parent = root.getParent()
+	root.reparentTo(stage)
+
+	# Queue the textures, vertex buffers and explicit shaders for upload
+	root.prepareScene(gsg)
+
+	# Generated shaders are only made when an object is drawn, so draw the
+	# tree once in every direction from its centre into a small buffer
+	rig = stage.attachNewNode('warmup-rig')
+	bounds = root.getBounds()
+	if not bounds.isEmpty():
+		rig.setPos(bounds.getCenter())
+	buffer = app.win.makeCubeMap('warmup', size, rig)
+	# Drawing a frame also uploads everything queued by prepareScene. The
+	# window is switched off meanwhile, so the half-switched scene isn't shown.
+	wasActive = app.win.isActive()
+	app.win.setActive(False)
+	try:
+		app.graphicsEngine.renderFrame()
+		app.graphicsEngine.syncFrame()
+	finally:
+		app.win.setActive(wasActive)
+
+	if buffer is not None:
+		app.graphicsEngine.removeWindow(buffer)
+	rig.removeNode()
+	if parent.isEmpty():
+		root.detachNode()
+	else:
+		root.reparentTo(parent)
+	stage.removeNode()
+
+	after = countPrepared(gsg)
+	stats = {kind: after[kind] - before[kind] for kind in after}
+	stats['milliseconds'] = (perf_counter() - start) * 1000
+	return stats